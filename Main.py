@@ -3,25 +3,65 @@
 # @Date    : 2023-01-17
 # @Author  : 王超逸
 # @Brief   :
+import argparse
 import sys
+from pathlib import Path
 
 from PyQt5 import QtGui
-from PyQt5.QtCore import Qt, QTimer
-from PyQt5.QtGui import QFont, QPainter, QPen, QColor
-from PyQt5.QtWidgets import QApplication, QMainWindow, QLabel, QVBoxLayout, QWidget, QMenu, QAction, \
-    QMessageBox
+from PyQt5.QtCore import Qt, QEvent
+from PyQt5.QtGui import QFont
+from PyQt5.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QWidget, QMenu, QAction, \
+    QMessageBox, QFileDialog
 
 import command
 import dialog
-from mytime import MyDateTime
+import stall_monitor
+import tick
+from clock_face import ClockFace, CachedBackground
+from clock_state import ClockState
+from grid_window import StageGridWindow
+from mytime import DatetimeContext
 from winEffect import WindowEffect
 import exception_hook
 assert exception_hook.qt_exception_hook  # 仅仅是为了让IDE知道，上面那一行不是无用的引入
 
 
+class ClockPanel(QWidget):
+    """
+    一个钟：现在几点、今天多长还剩多少。有名字时在上面显示名字（多个钟的时候）
+    """
+
+    def __init__(self, name: str = None, parent=None):
+        super().__init__(parent)
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        if name:
+            title = ClockFace(QFont("Microsoft Yahei UI", 14), margin=5)
+            title.setText(name)
+            layout.addWidget(title)
+        # 每个字符只渲染一次，之后只重画变化了的字符
+        self.label = ClockFace(QFont("Microsoft Yahei UI", 50), margin=5)
+        self.label2 = ClockFace(QFont("Microsoft Yahei UI", 20), margin=5)
+        layout.addWidget(self.label)
+        layout.addWidget(self.label2)
+        self.setLayout(layout)
+
+    def show_state(self, t: ClockState):
+        self.label.setText(f"{t.stage}-{t.cycle}-{t.day}  {t.hour:02}:{t.minute:02}:{t.second:02}")
+        self.label2.setText(
+            f"今天有{(t.day_length.total_seconds() / 3600):.1f}小时, 还剩{(t.remaining.total_seconds() / 3600):.01f}小时")
+
+
 class MainWindow(QMainWindow):
+    """
+    clocks是[(名字, DatetimeContext)]，默认只有一个默认的历法。多个钟时上下排列，共用一个TickDispatcher。
+    右键菜单里的命令总是作用在默认的历法上。
+
+    monitor_stalls为True时监视界面卡顿。心跳每秒要醒好几次，常驻桌面的钟默认不开
+    """
 
-    def __init__(self):
+    def __init__(self, clocks: list[tuple[str, DatetimeContext]] = None, dispatcher: tick.TickDispatcher = None,
+                 monitor_stalls=False):
         super().__init__()
 
         self.window_pos = None
@@ -37,30 +77,28 @@ class MainWindow(QMainWindow):
             raise FileNotFoundError(f"{icon_path}找不到")
         self.setWindowIcon(QtGui.QIcon(str(icon_path)))
 
+        self.background = CachedBackground()
+        if clocks is None:
+            clocks = [(None, command.default_context())]
+        # 所有的钟共用一个定时器，只在显示会变的时候醒；
+        # 有守护进程时从共享内存读今天的状态，没有就直接读保存文件
+        self.dispatcher = dispatcher or tick.shared()
         self.layout = QVBoxLayout()
-        self.label = QLabel()
-        self.label.setMargin(5)
-        self.label.setFont(QFont("Microsoft Yahei UI", 50))
-        self.label.setAlignment(Qt.AlignVCenter | Qt.AlignHCenter)
-        self.label2 = QLabel()
-        self.label2.setMargin(5)
-        self.label2.setFont(QFont("Microsoft Yahei UI", 20))
-        # self.label.setStyleSheet("color:#e0f0ff;")
-        # self.label2.setStyleSheet("color:#e0f0ff;")
-        self.label2.setAlignment(Qt.AlignVCenter | Qt.AlignHCenter)
-        self.layout.addWidget(self.label)
-        self.layout.addWidget(self.label2)
+        self.panels = []
+        self.subscriptions = []
+        for name, context in clocks:
+            panel = ClockPanel(name if len(clocks) > 1 else None)
+            self.layout.addWidget(panel)
+            self.panels.append(panel)
+            self.subscriptions.append(self.dispatcher.subscribe(panel.show_state, context))
         self.root = QWidget()
         self.root.setLayout(self.layout)
-        self.update_time()
 
         # Set the central widget of the Window.
         self.setCentralWidget(self.root)
         self.setFixedSize(self.root.minimumSize())
-        self.checkThreadTimer = QTimer(self)
-        self.checkThreadTimer.setInterval(500)  # .5 seconds
-        self.checkThreadTimer.timeout.connect(self.update_time)
-        self.checkThreadTimer.start()
+        # 保存文件、重新计算之类的操作把界面卡住时记下来
+        self.stall_monitor = stall_monitor.install(self) if monitor_stalls else None
 
         # 创建右键菜单
         context = QMenu(self)
@@ -71,25 +109,76 @@ class MainWindow(QMainWindow):
         def _1():
             tt = dialog.SetHourTodayDialog(self)
             tt.exec()
+            self.dispatcher.refresh()
 
         t = QAction("今天要多少小时？", self)
         t.triggered.connect(_1)
         context.addAction(t)
 
         t = QAction("现在还是昨天！", self)
-        t.triggered.connect(lambda: command.today_is_yesterday())
+        t.triggered.connect(lambda: self.run_command(command.today_is_yesterday))
+        context.addAction(t)
+
+        t = QAction("这个月", self)
+        t.triggered.connect(self.show_grid)
+        context.addAction(t)
+
+        if self.stall_monitor is not None:
+            t = QAction("卡顿记录", self)
+            t.triggered.connect(self.show_stalls)
+            context.addAction(t)
+
+        t = QAction("撤销", self)
+        t.triggered.connect(lambda: self.run_command(command.undo))
+        context.addAction(t)
+
+        t = QAction("重做", self)
+        t.triggered.connect(lambda: self.run_command(command.redo))
         context.addAction(t)
 
         t = QAction("退出", self)
         t.triggered.connect(lambda x: app.quit())
         context.addAction(t)
         self.context = context
+        self.grid_window = None
+
+    def run_command(self, func, *args):
+        """执行命令之后马上刷新，不用等到下一秒"""
+        try:
+            return func(*args)
+        finally:
+            self.dispatcher.refresh()
+
+    def show_grid(self):
+        if self.grid_window is None:
+            self.grid_window = StageGridWindow(parent=self, dispatcher=self.dispatcher)
+        self.grid_window.show()
+        self.grid_window.raise_()
+
+    def show_stalls(self):
+        monitor = self.stall_monitor
+        stats = monitor.stats()
+        stalls = monitor.history()
+        box = QMessageBox(self)
+        box.setWindowTitle("卡顿记录")
+        box.setText(f"超过{monitor.threshold * 1000:.0f}ms的卡顿{len(stalls)}次，"
+                    f"事件循环平均延迟{stats['mean_latency_ms']}ms，最大{stats['max_latency_ms']}ms")
+        if stalls:
+            box.setInformativeText("\n".join(str(stall) for stall in stalls[-10:]))
+            box.setDetailedText("\n\n".join(f"{stall}\n" + "\n".join(stall.stack) for stall in stalls[-10:]))
+        export = box.addButton("导出JSON", QMessageBox.ActionRole)
+        box.addButton(QMessageBox.Close)
+        box.exec()
+        if box.clickedButton() is export:
+            path, _ = QFileDialog.getSaveFileName(self, "导出卡顿记录", "stalls.json", "JSON (*.json)")
+            if path:
+                monitor.export_json(path)
 
     def good_night(self):
         button = QMessageBox.question(self, "呀", "要睡了吗")
 
         if button == QMessageBox.Yes:
-            command.good_night()
+            self.run_command(command.good_night)
 
     def contextMenuEvent(self, e):
         self.context.exec(e.globalPos())
@@ -101,20 +190,55 @@ class MainWindow(QMainWindow):
     def mouseMoveEvent(self, e):
         self.move(self.window_pos + (e.globalPos() - self.press_pos))
 
-    def update_time(self):
-        t = MyDateTime.now()
-        today = MyDateTime(t.stage, t.cycle, t.day)
-        next_day = MyDateTime(t.stage, t.cycle, t.day + 1, skip_check=True)
-        self.label.setText(f"{t.stage}-{t.cycle}-{t.day}  {t.hour:02}:{t.minute:02}:{t.second:02}")
-        self.label2.setText(
-            f"今天有{((next_day - today).total_seconds() / 3600):.1f}小时, 还剩{((next_day - t).total_seconds() / 3600):.01f}小时")
+    def set_active(self, active: bool):
+        for sub in self.subscriptions:
+            self.dispatcher.set_active(sub, active)
+        # 看不见的时候卡了也没人看到，心跳和后台线程一起停
+        if self.stall_monitor is not None:
+            self.stall_monitor.set_active(active)
+
+    def paintEvent(self, event):
+        self.background.paint(self, event)
+
+    def resizeEvent(self, event):
+        self.background.invalidate()
+        super().resizeEvent(event)
+
+    # 窗口看不见的时候不再刷新
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.set_active(True)
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.set_active(False)
+
+    def changeEvent(self, event):
+        super().changeEvent(event)
+        if event.type() == QEvent.WindowStateChange:
+            if self.isMinimized():
+                self.set_active(False)
+            elif self.isVisible():
+                self.set_active(True)
+
+    def closeEvent(self, event):
+        for sub in self.subscriptions:
+            self.dispatcher.unsubscribe(sub)
+        self.subscriptions = []
+        super().closeEvent(event)
+
 
-    def paintEvent(self, event=None):
-        painter = QPainter(self)
-        painter.setOpacity(0.05)
-        painter.setBrush(QColor(255, 180, 255))
-        painter.setPen(QPen(Qt.red))
-        painter.drawRect(self.rect())
+def parse_clock(spec: str) -> tuple[str, DatetimeContext]:
+    """
+    "小时数"或者"小时数,保存文件"，纪元和月、周的长度和默认的历法一样
+    """
+    hours, _, save = spec.partition(",")
+    base = command.default_context()
+    save_path = Path(save) if save else base.save_path
+    context = DatetimeContext(base.zero_point, float(hours), base.day_per_cycle, base.cycle_per_stage, save_path)
+    name = f"{float(hours):g}小时" + (f" {save_path.stem}" if save else "")
+    return name, context
 
 
 Debug = False
@@ -122,11 +246,21 @@ if __name__ == '__main__':
     import ctypes, path_def
 
     path_def.init_path(__file__)
+    parser = argparse.ArgumentParser(description="唯心主义者时钟")
+    parser.add_argument("--clock", action="append", metavar="HOURS[,SAVE]",
+                        help="再显示一个钟：每天的小时数，可以加上逗号和另一个保存文件。可以给多次")
+    parser.add_argument("--stall-monitor", action="store_true",
+                        help="监视界面卡顿，右键菜单里可以看卡顿记录。会让程序每秒多醒好几次，默认关闭")
+    args, qt_args = parser.parse_known_args()
+    exception_hook.start_logging(path_def.ENTRY_POINT_DIR / "logs")
     # 传递appid，使得windows知道这个app不应该使用python的图标
     myappid = 'ChaochaoTime'  # arbitrary string
     ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
 
-    app = QApplication(sys.argv)
-    window = MainWindow()
+    app = QApplication(sys.argv[:1] + qt_args)
+    clocks = None
+    if args.clock:
+        clocks = [("默认", command.default_context())] + [parse_clock(spec) for spec in args.clock]
+    window = MainWindow(clocks, monitor_stalls=args.stall_monitor)
     window.show()
     app.exec()
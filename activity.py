@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# @File    : activity.py
+# @Date    : 2026-10-19
+# @Author  : 王超逸
+# @Brief   : 记录每个线程当前在做哪些引擎操作，别的线程（卡顿监视）可以随时看
+from __future__ import annotations
+
+import functools
+import threading
+import weakref
+
+
+class _Stack(list):
+    __slots__ = ("__weakref__",)
+
+
+# 线程id -> 正在做的操作，外层在前。栈由线程自己的threading.local持有，线程结束就自动消失
+_stacks: weakref.WeakValueDictionary[int, _Stack] = weakref.WeakValueDictionary()
+_local = threading.local()
+
+
+def _stack() -> _Stack:
+    try:
+        return _local.stack
+    except AttributeError:
+        stack = _local.stack = _Stack()
+        _stacks[threading.get_ident()] = stack
+        return stack
+
+
+class operation:
+    """
+    标记一段代码在做什么：
+
+        with operation("sync"):
+            ...
+    """
+    __slots__ = ("name",)
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        _stack().append(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _stack().pop()
+
+
+def traced(func):
+    """装饰器，调用期间记为一个操作，名字是函数的__qualname__"""
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        stack = _stack()
+        stack.append(name)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stack.pop()
+
+    return wrapper
+
+
+def current(thread_id: int = None) -> tuple[str, ...]:
+    """某个线程（默认是当前线程）正在做的操作，外层在前，没有则是空的"""
+    if thread_id is None:
+        thread_id = threading.get_ident()
+    stack = _stacks.get(thread_id)
+    return tuple(stack) if stack else ()
+
+
+__all__ = ["operation", "traced", "current"]
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# @File    : clock.py
+# @Date    : 2026-10-19
+# @Author  : 王超逸
+# @Brief   : 物理时间的来源。默认是系统时间，也可以换成固定的或者加速的虚拟时间
+from __future__ import annotations
+
+import threading
+import time
+from datetime import timedelta
+
+_ONE_US = timedelta(microseconds=1)
+
+
+class Clock:
+    """
+    返回当前的物理时间，微秒时间戳
+    """
+
+    def now_us(self) -> int:
+        raise NotImplementedError
+
+    def now(self) -> float:
+        return self.now_us() / 1000000
+
+
+class RealClock(Clock):
+    def now_us(self) -> int:
+        return time.time_ns() // 1000
+
+    def __repr__(self):
+        return "<RealClock>"
+
+
+class FixedClock(Clock):
+    """
+    停住的钟，只有手动set或者advance才会走
+    """
+
+    def __init__(self, now_us: int = None):
+        self._now_us = time.time_ns() // 1000 if now_us is None else now_us
+        self._lock = threading.Lock()
+
+    def now_us(self) -> int:
+        return self._now_us
+
+    def set(self, now_us: int):
+        with self._lock:
+            self._now_us = now_us
+
+    def advance(self, delta: timedelta | int):
+        """delta可以是timedelta或者微秒数"""
+        if isinstance(delta, timedelta):
+            delta = delta // _ONE_US
+        with self._lock:
+            self._now_us += delta
+            return self._now_us
+
+    def __repr__(self):
+        return f"<FixedClock {self._now_us}>"
+
+
+class AcceleratedClock(Clock):
+    """
+    从start_us开始，以rate倍速走的钟
+    """
+
+    def __init__(self, rate: float, start_us: int = None):
+        self.rate = rate
+        self.start_us = time.time_ns() // 1000 if start_us is None else start_us
+        self._origin_ns = time.perf_counter_ns()
+
+    def now_us(self) -> int:
+        return self.start_us + int((time.perf_counter_ns() - self._origin_ns) * self.rate) // 1000
+
+    def __repr__(self):
+        return f"<AcceleratedClock x{self.rate}>"
+
+
+REAL_CLOCK = RealClock()
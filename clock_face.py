@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+# @File    : clock_face.py
+# @Date    : 2026-10-19
+# @Author  : 王超逸
+# @Brief   : 带缓存的文字绘制。每个字符只排版、渲染一次，之后只重画变化了的字符
+from __future__ import annotations
+
+import sys
+import time
+
+from PyQt5.QtCore import Qt, QRect, QSize
+from PyQt5.QtGui import QFont, QFontMetrics, QPainter, QPixmap, QColor, QPalette, QRegion
+from PyQt5.QtWidgets import QWidget, QSizePolicy
+
+
+class GlyphAtlas:
+    """
+    一种字体、一种颜色下每个字符渲染好的图片。字符第一次出现时渲染，之后直接贴图
+    """
+
+    def __init__(self, font: QFont, color: QColor, device_pixel_ratio: float = 1.):
+        self.font = font
+        self.color = QColor(color)
+        self.device_pixel_ratio = device_pixel_ratio
+        self.metrics = QFontMetrics(font)
+        self.height = self.metrics.height()
+        self._glyphs: dict[str, tuple[int, QPixmap]] = {}
+        # 数字用同样的宽度，时间跳动的时候后面的字符不会跟着移动
+        self.digit_width = max(self.metrics.horizontalAdvance(c) for c in "0123456789")
+
+    def advance(self, char: str) -> int:
+        return self.glyph(char)[0]
+
+    def glyph(self, char: str) -> tuple[int, QPixmap]:
+        glyph = self._glyphs.get(char)
+        if glyph is None:
+            glyph = self._glyphs[char] = self._render(char)
+        return glyph
+
+    def _render(self, char: str) -> tuple[int, QPixmap]:
+        advance = self.digit_width if char.isdigit() else self.metrics.horizontalAdvance(char)
+        ratio = self.device_pixel_ratio
+        pixmap = QPixmap(max(1, round(advance * ratio)), max(1, round(self.height * ratio)))
+        pixmap.setDevicePixelRatio(ratio)
+        pixmap.fill(Qt.transparent)
+        painter = QPainter(pixmap)
+        painter.setFont(self.font)
+        painter.setPen(self.color)
+        painter.drawText(QRect(0, 0, advance, self.height), Qt.AlignCenter, char)
+        painter.end()
+        return advance, pixmap
+
+
+class ClockFace(QWidget):
+    """
+    代替QLabel显示一行不断变化的文字。
+
+    setText只计算新文字的排版（整数加法），和上一次比较后只对变化了的字符所在的矩形调用update
+    （总宽度变了的话字符都会移动，整个重画），paintEvent只把这些字符的图片贴上去，不做文字排版和光栅化
+    """
+
+    def __init__(self, font: QFont, margin: int = 0, parent=None):
+        super().__init__(parent)
+        self.setFont(font)
+        self._margin = margin
+        self._text = ""
+        self._xs: list[int] = [0]
+        self._atlas: GlyphAtlas | None = None
+        self.setAttribute(Qt.WA_TranslucentBackground)
+        self.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Fixed)
+
+    @property
+    def atlas(self) -> GlyphAtlas:
+        color = self.palette().color(QPalette.WindowText)
+        ratio = self.devicePixelRatioF()
+        atlas = self._atlas
+        if atlas is None or atlas.font != self.font() or atlas.color != color or \
+                atlas.device_pixel_ratio != ratio:
+            atlas = self._atlas = GlyphAtlas(self.font(), color, ratio)
+            self._xs = self._layout(self._text, atlas)
+        return atlas
+
+    @staticmethod
+    def _layout(text: str, atlas: GlyphAtlas) -> list[int]:
+        advance = atlas.advance
+        xs = [0]
+        for char in text:
+            xs.append(xs[-1] + advance(char))
+        return xs
+
+    def text(self):
+        return self._text
+
+    def setText(self, text: str):
+        if text == self._text:
+            return
+        atlas = self.atlas
+        old_text, old_xs = self._text, self._xs
+        xs = self._layout(text, atlas)
+        self._text, self._xs = text, xs
+        if xs[-1] != old_xs[-1]:
+            # 文字居中，宽度一变所有字符都挪了位置，整个重画
+            self.updateGeometry()
+            self.update()
+            return
+
+        x0 = self._text_origin()
+        dirty = QRegion()
+        for i in range(max(len(text), len(old_text))):
+            if i < len(text) and i < len(old_text) and text[i] == old_text[i] and xs[i] == old_xs[i]:
+                continue
+            if i < len(old_text):
+                dirty = dirty.united(QRect(x0.x() + old_xs[i], x0.y(), old_xs[i + 1] - old_xs[i], atlas.height))
+            if i < len(text):
+                dirty = dirty.united(QRect(x0.x() + xs[i], x0.y(), xs[i + 1] - xs[i], atlas.height))
+        if not dirty.isEmpty():
+            self.update(dirty)
+
+    def _text_origin(self):
+        # 和QLabel的AlignVCenter | AlignHCenter一致
+        atlas = self.atlas
+        x = (self.width() - self._xs[-1]) // 2
+        y = (self.height() - atlas.height) // 2
+        return QRect(x, y, self._xs[-1], atlas.height).topLeft()
+
+    def sizeHint(self):
+        return QSize(self._xs[-1] + 2 * self._margin, self.atlas.height + 2 * self._margin)
+
+    def minimumSizeHint(self):
+        return self.sizeHint()
+
+    def paintEvent(self, event):
+        atlas = self.atlas
+        origin = self._text_origin()
+        region = event.region()
+        painter = QPainter(self)
+        xs = self._xs
+        for i, char in enumerate(self._text):
+            rect = QRect(origin.x() + xs[i], origin.y(), xs[i + 1] - xs[i], atlas.height)
+            if not region.intersects(rect):
+                continue
+            painter.drawPixmap(rect.topLeft(), atlas.glyph(char)[1])
+        painter.end()
+
+
+class CachedBackground:
+    """
+    窗口半透明的底色。按窗口大小画一次，之后只贴需要重画的部分
+    """
+
+    def __init__(self, opacity=0.05, brush=QColor(255, 180, 255), pen=QColor(Qt.red)):
+        self.opacity = opacity
+        self.brush = brush
+        self.pen = pen
+        self._pixmap: QPixmap | None = None
+
+    def invalidate(self):
+        self._pixmap = None
+
+    def pixmap(self, widget: QWidget) -> QPixmap:
+        ratio = widget.devicePixelRatioF()
+        size = widget.size()
+        pixmap = self._pixmap
+        if pixmap is None or pixmap.devicePixelRatio() != ratio or \
+                pixmap.width() != round(size.width() * ratio) or pixmap.height() != round(size.height() * ratio):
+            pixmap = QPixmap(round(size.width() * ratio), round(size.height() * ratio))
+            pixmap.setDevicePixelRatio(ratio)
+            pixmap.fill(Qt.transparent)
+            painter = QPainter(pixmap)
+            painter.setOpacity(self.opacity)
+            painter.setBrush(self.brush)
+            painter.setPen(self.pen)
+            painter.drawRect(widget.rect())
+            painter.end()
+            self._pixmap = pixmap
+        return pixmap
+
+    def paint(self, widget: QWidget, event):
+        painter = QPainter(widget)
+        painter.setCompositionMode(QPainter.CompositionMode_Source)
+        pixmap = self.pixmap(widget)
+        ratio = pixmap.devicePixelRatio()
+        for rect in event.region().rects():
+            source = QRect(round(rect.x() * ratio), round(rect.y() * ratio),
+                           round(rect.width() * ratio), round(rect.height() * ratio))
+            painter.drawPixmap(rect, pixmap, source)
+        painter.end()
+
+
+def benchmark(frames=2000):
+    """
+    比较QLabel和ClockFace每一帧的耗时，可以在没有显示器的环境下跑：
+
+        QT_QPA_PLATFORM=offscreen python clock_face.py
+    """
+    from PyQt5.QtWidgets import QApplication, QLabel
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    font = QFont("Microsoft Yahei UI", 50)
+    texts = [f"3-2-5  00:{m:02}:{s:02}" for m in range(60) for s in range(60)]
+
+    label = QLabel()
+    label.setFont(font)
+    label.setMargin(5)
+    label.setAlignment(Qt.AlignVCenter | Qt.AlignHCenter)
+    label.setText(texts[0])
+    label.resize(label.sizeHint())
+
+    face = ClockFace(font, margin=5)
+    face.setText(texts[0])
+    face.resize(face.sizeHint())
+
+    results = {}
+    for name, widget in (("QLabel", label), ("ClockFace", face)):
+        widget.show()
+        app.processEvents()
+        start = time.perf_counter()
+        for i in range(frames):
+            widget.setText(texts[i % len(texts)])
+            # 让被update标记的区域真正画出来
+            app.processEvents()
+        results[name] = (time.perf_counter() - start) / frames * 1e6
+        widget.hide()
+    for name, us in results.items():
+        print(f"{name:>10}: {us:8.1f} us/frame")
+    return results
+
+
+if __name__ == '__main__':
+    benchmark()
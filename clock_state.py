@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# @File    : clock_state.py
+# @Date    : 2026-10-19
+# @Author  : 王超逸
+# @Brief   : 某一时刻的钟面。守护进程发布的、直接从保存文件算的都是它，界面只依赖这里
+from __future__ import annotations
+
+from datetime import timedelta
+from typing import NamedTuple
+
+from mytime import DatetimeContext, US_PER_SEC
+
+
+def _split_day(total_day: int, context: DatetimeContext):
+    total_day, d = divmod(total_day, context.day_per_cycle)
+    s, c = divmod(total_day, context.cycle_per_stage)
+    return s + 1, c + 1, d + 1
+
+
+class ClockState(NamedTuple):
+    """
+    某一时刻的钟面。日期和今天的起止来自守护进程或者保存文件，时分秒是现算的
+    """
+    timestamp_us: int
+    total_day: int
+    stage: int
+    cycle: int
+    day: int
+    day_start_us: int
+    day_end_us: int
+    revision: int
+
+    @classmethod
+    def from_context(cls, context: DatetimeContext, now_us: int) -> ClockState:
+        total_day, _ = context.get_total_day_us(now_us)
+        return cls(now_us, total_day, *_split_day(total_day, context),
+                   context.day_start_us(total_day), context.day_start_us(total_day + 1),
+                   context._file_cache.revision)
+
+    @property
+    def _us_of_day(self):
+        return self.timestamp_us - self.day_start_us
+
+    @property
+    def hour(self):
+        return self._us_of_day // (3600 * US_PER_SEC)
+
+    @property
+    def minute(self):
+        return self._us_of_day // (60 * US_PER_SEC) % 60
+
+    @property
+    def second(self):
+        return self._us_of_day // US_PER_SEC % 60
+
+    @property
+    def microsecond(self):
+        return self._us_of_day % US_PER_SEC
+
+    @property
+    def day_length(self) -> timedelta:
+        return timedelta(microseconds=self.day_end_us - self.day_start_us)
+
+    @property
+    def remaining(self) -> timedelta:
+        return timedelta(microseconds=self.day_end_us - self.timestamp_us)
+
+    def __str__(self):
+        return f"{self.stage}-{self.cycle}-{self.day} {self.hour:02}:{self.minute:02}:{self.second:02}"
+
+
+__all__ = ["ClockState"]
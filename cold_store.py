@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# @File    : cold_store.py
+# @Date    : 2026-10-19
+# @Author  : 王超逸
+# @Brief   : 历史分界点的冷存储。差分+varint编码再压缩，按块追加，写进去就不再改
+from __future__ import annotations
+
+import os
+import zlib
+from pathlib import Path
+
+# 保存文件中至少保留这么多个分界点不封存，最近的修改都落在这里
+HOT_MIN = 64
+# 每个冷块的分界点个数
+BLOCK_SIZE = 512
+
+
+class ColdStoreError(ValueError):
+    pass
+
+
+def encode_block(values) -> bytes:
+    """
+    第一个值存绝对值，后面存差分，都做zigzag之后按varint写出，最后整体压缩
+    """
+    out = bytearray()
+    append = out.append
+    prev = 0
+    for v in values:
+        d = v - prev
+        prev = v
+        d = d * 2 if d >= 0 else -d * 2 - 1
+        while d >= 0x80:
+            append((d & 0x7f) | 0x80)
+            d >>= 7
+        append(d)
+    return zlib.compress(bytes(out), 9)
+
+
+def decode_block(data: bytes, count: int) -> list[int]:
+    raw = zlib.decompress(data)
+    values = []
+    append = values.append
+    prev = 0
+    d = 0
+    shift = 0
+    for byte in raw:
+        d |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        d = (d >> 1) ^ -(d & 1)
+        # 除了第一个，差分都必须是正的，解码的同时就检查了严格递增
+        if d <= 0 and values:
+            raise ColdStoreError("冷块不是严格递增的", len(values))
+        prev += d
+        append(prev)
+        d = 0
+        shift = 0
+    if shift or len(values) != count:
+        raise ColdStoreError("冷块已损坏", count, len(values))
+    return values
+
+
+class ColdStore:
+    """
+    一个保存文件对应的冷存储文件 <保存文件名>.cold.<代数>。
+
+    块的索引（偏移、长度、个数、crc）记在保存文件里，冷文件本身只追加。
+    热数据之前的部分被改动了（很少见）就写一个新的一代，旧的一代保留到下一次重写，
+    这样.bak里引用的冷文件也总是存在的
+    """
+
+    def __init__(self, save_path: Path):
+        self.save_path = save_path
+        self.generation = 0
+        # (offset, length, count, crc32)
+        self.blocks: list[tuple[int, int, int, int]] = []
+        self.count = 0
+        # 封存的块不会再变，解码过的按(代数, 块)缓存起来，重新读取时不用再解码
+        self._decoded: dict[tuple, list[int]] = {}
+
+    def file_path(self, generation=None) -> Path:
+        if generation is None:
+            generation = self.generation
+        return self.save_path.parent / f"{self.save_path.name}.cold.{generation}"
+
+    def index(self) -> dict | None:
+        if not self.blocks:
+            return None
+        return {"generation": self.generation, "blocks": [list(b) for b in self.blocks]}
+
+    def load(self, index: dict | None, strict=True) -> list[int]:
+        """
+        按保存文件中的索引读出全部冷数据。strict为False时遇到读不出来或者损坏的块就停下，
+        只返回前面完好的部分
+        """
+        self.generation = 0
+        self.blocks = []
+        self.count = 0
+        if not index:
+            return []
+        generation = index["generation"]
+        blocks = [tuple(b) for b in index["blocks"]]
+        values = []
+        decoded = {}
+        good = []
+        try:
+            with self.file_path(generation).open("rb") as fp:
+                for block in blocks:
+                    key = (generation,) + block
+                    block_values = self._decoded.get(key)
+                    if block_values is None:
+                        offset, length, count, crc = block
+                        fp.seek(offset)
+                        data = fp.read(length)
+                        if len(data) != length or zlib.crc32(data) != crc:
+                            raise ColdStoreError("冷块校验失败", offset)
+                        block_values = decode_block(data, count)
+                    if values and block_values and block_values[0] <= values[-1]:
+                        raise ColdStoreError("冷块之间不是严格递增的", block[0])
+                    decoded[key] = block_values
+                    values.extend(block_values)
+                    good.append(block)
+        except (OSError, zlib.error, ColdStoreError):
+            if strict:
+                raise
+        self._decoded = decoded
+        self.generation = generation
+        self.blocks = good
+        self.count = len(values)
+        return values
+
+    def restart(self):
+        """
+        丢掉现有的块，下次封存时写新的一代。从损坏的文件中恢复之后用，不去追加可能已经损坏的冷文件，
+        也不覆盖.bak可能引用的任何一代
+        """
+        prefix = self.save_path.name + ".cold."
+        generations = [int(path.name[len(prefix):]) for path in self.save_path.parent.glob(prefix + "*")
+                       if path.name[len(prefix):].isdigit()]
+        self.generation = max(generations + [self.generation]) + 1
+        self.blocks = []
+        self.count = 0
+
+    def seal(self, day_time_list, dirty_from: int):
+        """
+        把day_time_list中超出热区的部分封存成冷块。dirty_from之前的数据没有变过，
+        如果它落在已经封存的范围里，就整个重写成新的一代
+        """
+        if dirty_from < self.count:
+            self.generation += 1
+            self.blocks = []
+            self.count = 0
+        new_blocks = []
+        count = self.count
+        while len(day_time_list) - count >= HOT_MIN + BLOCK_SIZE:
+            new_blocks.append(encode_block(day_time_list[count:count + BLOCK_SIZE]))
+            count += BLOCK_SIZE
+        if not new_blocks:
+            if not self.blocks:
+                self._remove_stale()
+            return
+        path = self.file_path()
+        end = self.blocks[-1][0] + self.blocks[-1][1] if self.blocks else 0
+        with path.open("r+b" if end and path.exists() else "wb") as fp:
+            # 上次追加到一半就崩溃的话，索引之后可能有垃圾，截掉
+            fp.truncate(end)
+            fp.seek(end)
+            for data in new_blocks:
+                fp.write(data)
+                self.blocks.append((end, len(data), BLOCK_SIZE, zlib.crc32(data)))
+                end += len(data)
+            fp.flush()
+            os.fsync(fp.fileno())
+        self.count = count
+        self._remove_stale()
+
+    def _remove_stale(self):
+        # 保留上一代给.bak用
+        prefix = self.save_path.name + ".cold."
+        for path in self.save_path.parent.glob(prefix + "*"):
+            suffix = path.name[len(prefix):]
+            if suffix.isdigit() and int(suffix) < self.generation - 1:
+                path.unlink()
@@ -5,9 +5,12 @@
 # @Author  : 王超逸
 # @Brief   :
 
-from mytime import MyDateTime, FileCacheLine
+from activity import traced
+from mytime import MyDateTime, FileCacheLine, OverlayContext, US_PER_SEC
 from datetime import timedelta
-import time as _time
+import logging
+
+log = logging.getLogger(__name__)
 
 
 def default_context():
@@ -16,32 +19,112 @@ def default_context():
     return default_context.cache
 
 
-def _today_or_yesterday(data_cache: FileCacheLine, ts=..., boundary=0):
-    if ts is ...:
-        ts = _time.time()
+def _get_context(context):
+    if context is ...:
+        return default_context()
+    return context
+
+
+def transaction(context=...):
+    """
+    把多个命令合成一次修改，只保存一次、通知一次，有异常则全部回滚
+
+        with command.transaction():
+            command.good_night()
+            command.set_today_hours(20)
+    """
+    return _get_context(context).transaction()
+
+
+def _today_or_yesterday(data_cache: FileCacheLine, ts: int, boundary=0):
     data_cache.calc_timestamp_until(ts)
     while data_cache.file_data[-1] > ts:
         data_cache.file_data.pop()
-    if ts - data_cache.file_data[-1] < timedelta(hours=boundary).total_seconds():
+    if ts - data_cache.file_data[-1] < boundary * 3600 * US_PER_SEC:
         data_cache.file_data.pop()
 
 
-def good_night(dt: timedelta = timedelta(minutes=40)):
-    with default_context().edit_date() as data_cache:
-        ts = _time.time()
-        next_day_start_time = ts + dt.total_seconds()
+@traced
+def good_night(dt: timedelta = timedelta(minutes=40), context=...):
+    log.info("晚安，%s后开始新的一天", dt)
+    context = _get_context(context)
+    with context.edit_date() as data_cache:
+        ts = context.clock.now_us()
+        next_day_start_time = ts + dt // timedelta(microseconds=1)
         _today_or_yesterday(data_cache, ts, boundary=12)
-        data_cache.file_data.append(int(next_day_start_time))
+        data_cache.file_data.append(next_day_start_time // US_PER_SEC * US_PER_SEC)
+
+
+@traced
+def set_today_hours(hours: float, context=...):
+    log.info("今天有%s小时", hours)
+    _set_today_hours(hours, _get_context(context))
+
+
+def preview_today_hours(hours: float, overlay: OverlayContext):
+    """
+    在草稿上算出set_today_hours(hours)的结果，草稿上原来的修改先丢掉。
+    拖动输入框时每一步都会调用，所以不记日志，也不算一次引擎操作；确定时再正式执行set_today_hours
+    """
+    overlay.discard()
+    _set_today_hours(hours, overlay)
+
+
+def _set_today_hours(hours: float, context):
+    with context.edit_date() as data_cache:
+        _today_or_yesterday(data_cache, context.clock.now_us(), boundary=4)
+        data_cache.file_data.append(data_cache.file_data[-1] + int(3600 * hours) * US_PER_SEC)
+
+
+@traced
+def today_is_yesterday(context=...):
+    log.info("今天是昨天")
+    context = _get_context(context)
+    with context.edit_date() as data_cache:
+        ts = context.clock.now_us()
+        _today_or_yesterday(data_cache, ts)
+        data_cache.file_data[-1] = ts + 3600 * US_PER_SEC  # 将今天的结束时间调整到一小时后
+
+
+@traced
+def undo(context=...):
+    """撤销上一次修改，没有可撤销的则返回False"""
+    log.info("撤销")
+    with _get_context(context).edit_date() as data_cache:
+        return data_cache.undo()
+
+
+@traced
+def redo(context=...):
+    """重做被撤销的修改，没有可重做的则返回False"""
+    log.info("重做")
+    with _get_context(context).edit_date() as data_cache:
+        return data_cache.redo()
+
+
+# 异步版本：命令在io线程中执行，同一个保存文件上的命令依次进行，不阻塞事件循环。
+# 不能在context.aedit_date()里面调用
+
+async def agood_night(dt: timedelta = timedelta(minutes=40), context=...):
+    context = _get_context(context)
+    return await context.arun(good_night, dt, context=context)
+
+
+async def aset_today_hours(hours: float, context=...):
+    context = _get_context(context)
+    return await context.arun(set_today_hours, hours, context=context)
+
+
+async def atoday_is_yesterday(context=...):
+    context = _get_context(context)
+    return await context.arun(today_is_yesterday, context=context)
 
 
-def set_today_hours(hours: float):
-    with default_context().edit_date() as data_cache:
-        _today_or_yesterday(data_cache, boundary=4)
-        data_cache.file_data.append(int(data_cache.file_data[-1] + 3600 * hours))
+async def aundo(context=...):
+    context = _get_context(context)
+    return await context.arun(undo, context=context)
 
 
-def today_is_yesterday():
-    with default_context().edit_date() as data_cache:
-        ts = _time.time()
-        _today_or_yesterday(data_cache, ts=ts)
-        data_cache.file_data[-1] = ts + 3600  # 将今天的结束时间调整到一小时后
+async def aredo(context=...):
+    context = _get_context(context)
+    return await context.arun(redo, context=context)
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+# @File    : daemon.py
+# @Date    : 2026-10-19
+# @Author  : 王超逸
+# @Brief   : 本地守护进程。一个进程持有DatetimeContext，通过unix socket接受修改，把今天的状态发布到共享内存
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from datetime import timedelta
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import command
+from activity import traced
+from clock_state import ClockState
+from mytime import DatetimeContext, US_PER_SEC
+
+log = logging.getLogger(__name__)
+
+# 共享内存的内容：seq, 心跳(time_ns), revision, 今天开始, 今天结束(微秒), total_day, stage, cycle, day, pid。
+# seq是seqlock：写之前加一变成奇数，写完再加一变回偶数，读的人前后两次读到同一个偶数才算数
+_LAYOUT = struct.Struct("<QqQqqqiiii")
+_SEQ = struct.Struct("<Q")
+# 心跳超过这么久没有更新，就认为守护进程已经不在了
+STALE_NS = 5 * 10 ** 9
+# 守护进程多久检查一次保存文件有没有被别人直接改过，同时更新心跳
+POLL_INTERVAL = 0.5
+
+
+class DaemonError(RuntimeError):
+    """守护进程执行命令时出错"""
+
+
+def _good_night(context: DatetimeContext, minutes: float = 40):
+    return command.good_night(timedelta(minutes=minutes), context=context)
+
+
+def _set_today_hours(context: DatetimeContext, hours: float):
+    return command.set_today_hours(hours, context=context)
+
+
+def _today_is_yesterday(context: DatetimeContext):
+    return command.today_is_yesterday(context=context)
+
+
+def _undo(context: DatetimeContext):
+    return command.undo(context=context)
+
+
+def _redo(context: DatetimeContext):
+    return command.redo(context=context)
+
+
+# 可以通过socket执行的命令，参数都是json能表示的
+COMMANDS = {
+    "good_night": _good_night,
+    "set_today_hours": _set_today_hours,
+    "today_is_yesterday": _today_is_yesterday,
+    "undo": _undo,
+    "redo": _redo,
+}
+
+
+def shm_name(context: DatetimeContext) -> str:
+    """
+    按整个历法规则取名，不只是保存文件：同一个文件上一天26小时和24小时的钟今天的起止不一样，
+    命令（比如晚安）算出来的结果也不一样，不能共用一个守护进程
+    """
+    zero_point, hour_per_day, day_per_cycle, cycle_per_stage, save_path = context.get_tuple()
+    # 26和26.0是同一个规则，进程之间要得到同一个名字
+    key = f"{zero_point}|{float(hour_per_day)!r}|{day_per_cycle}|{cycle_per_stage}|{save_path}"
+    return f"mytime-{zlib.crc32(key.encode('utf-8')):08x}"
+
+
+def socket_path(context: DatetimeContext) -> Path:
+    # unix socket的路径有长度限制，不放在保存文件旁边
+    return Path(tempfile.gettempdir()) / f"{shm_name(context)}.sock"
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """只读方式打开守护进程的共享内存。不能让resource_tracker在本进程退出时把它删掉"""
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # python3.13之前没有track参数
+        shm = shared_memory.SharedMemory(name)
+        if os.name == "posix":
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")  # noqa
+        return shm
+
+
+class ClockDaemon:
+    """
+    持有context的守护进程。修改都在这里执行，每次修改、每天开始、每POLL_INTERVAL秒更新一次共享内存
+    """
+
+    def __init__(self, context: DatetimeContext, poll_interval: float = POLL_INTERVAL):
+        self.context = context
+        self.poll_interval = poll_interval
+        self.shm_name = shm_name(context)
+        self.socket_path = socket_path(context)
+        self._shm: shared_memory.SharedMemory | None = None
+        self._server = None
+        self._stop = threading.Event()
+        self._publish_lock = threading.Lock()
+
+    def _create_shm(self):
+        try:
+            return shared_memory.SharedMemory(self.shm_name, create=True, size=_LAYOUT.size)
+        except FileExistsError:
+            # 上一个守护进程没有正常退出
+            stale = shared_memory.SharedMemory(self.shm_name)
+            stale.close()
+            stale.unlink()
+            return shared_memory.SharedMemory(self.shm_name, create=True, size=_LAYOUT.size)
+
+    def publish(self) -> ClockState:
+        context = self.context
+        with context._file_cache.lock:
+            state = ClockState.from_context(context, context.clock.now_us())
+        with self._publish_lock:
+            buf = self._shm.buf
+            seq = _SEQ.unpack_from(buf)[0]
+            _SEQ.pack_into(buf, 0, seq + 1)
+            _LAYOUT.pack_into(buf, 0, seq + 1, time.time_ns(), state.revision, state.day_start_us,
+                              state.day_end_us, state.total_day, state.stage, state.cycle, state.day, os.getpid())
+            _SEQ.pack_into(buf, 0, seq + 2)
+        return state
+
+    def _publish_loop(self):
+        file_cache = self.context._file_cache
+        delay = 0.
+        while not self._stop.wait(delay):
+            try:
+                with file_cache.lock:
+                    if file_cache.reload_if_changed():
+                        self.context.on_change(save=False)
+                state = self.publish()
+            except Exception:
+                log.exception("更新共享内存失败")
+                delay = self.poll_interval
+                continue
+            # 到了明天要马上更新
+            until_tomorrow = (state.day_end_us - self.context.clock.now_us()) / US_PER_SEC
+            delay = max(0., min(self.poll_interval, until_tomorrow))
+
+    def handle(self, request: dict) -> dict:
+        name = request.get("command")
+        if name == "ping":
+            return {"ok": True, "pid": os.getpid()}
+        if name == "stop":
+            threading.Thread(target=self.shutdown, daemon=True).start()
+            return {"ok": True}
+        func = COMMANDS.get(name)
+        if func is None:
+            return {"ok": False, "error": f"没有这个命令: {name!r}"}
+        try:
+            result = func(self.context, **request.get("args", {}))
+        except Exception as e:
+            log.warning("执行%s失败: %r", name, e)
+            return {"ok": False, "error": repr(e)}
+        state = self.publish()
+        return {"ok": True, "result": result, "revision": state.revision}
+
+    def serve_forever(self):
+        if not hasattr(socket, "AF_UNIX"):
+            raise OSError("这个平台不支持unix socket")
+        if _request(self.socket_path, {"command": "ping"}) is not None:
+            raise RuntimeError(f"{self.context.save_path}的守护进程已经在运行")
+        self.socket_path.unlink(missing_ok=True)
+        self._shm = self._create_shm()
+        self._stop.clear()
+        publisher = threading.Thread(target=self._publish_loop, name="publisher", daemon=True)
+        self._server = socketserver.ThreadingUnixStreamServer(str(self.socket_path), _Handler)
+        self._server.daemon_threads = True
+        self._server.clock_daemon = self
+        log.info("守护进程启动，保存文件%s，socket %s", self.context.save_path, self.socket_path)
+        try:
+            self.publish()
+            publisher.start()
+            self._server.serve_forever()
+        finally:
+            self._stop.set()
+            if publisher.is_alive():
+                publisher.join()
+            self._server.server_close()
+            self.socket_path.unlink(missing_ok=True)
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+            log.info("守护进程退出")
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    # 一行一个json请求，回复也是一行一个json
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                reply = self.server.clock_daemon.handle(json.loads(line))
+            except ValueError as e:
+                reply = {"ok": False, "error": repr(e)}
+            self.wfile.write(json.dumps(reply, ensure_ascii=False).encode("utf-8") + b"\n")
+
+
+def _request(path: Path, request: dict, timeout=5.) -> dict | None:
+    """发送一个请求，守护进程不在就返回None"""
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(str(path))
+            with sock.makefile("rwb") as fp:
+                fp.write(json.dumps(request, ensure_ascii=False).encode("utf-8") + b"\n")
+                fp.flush()
+                line = fp.readline()
+    except (FileNotFoundError, ConnectionRefusedError):
+        return None
+    if not line:
+        return None
+    return json.loads(line)
+
+
+class DaemonClient:
+    """
+    读取守护进程发布的状态、把命令发给守护进程。守护进程不在的时候直接读写保存文件，调用的人不用关心
+
+        client = DaemonClient()
+        print(client.now())
+        client.command("good_night", minutes=30)
+    """
+
+    def __init__(self, context=..., retry_interval: float = 5.):
+        self.context = command.default_context() if context is ... else context
+        self.retry_interval = retry_interval
+        self.shm_name = shm_name(self.context)
+        self.socket_path = socket_path(self.context)
+        self._shm: shared_memory.SharedMemory | None = None
+        self._next_attach = 0.
+
+    def _buf(self):
+        if self._shm is None:
+            now = time.monotonic()
+            if now < self._next_attach:
+                return None
+            self._next_attach = now + self.retry_interval
+            try:
+                self._shm = _attach(self.shm_name)
+            except OSError:
+                return None
+        return self._shm.buf
+
+    def close(self):
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+    def read(self) -> tuple | None:
+        """
+        守护进程最近一次发布的内容，见_LAYOUT。守护进程不在就返回None
+        """
+        buf = self._buf()
+        if buf is None:
+            return None
+        for _ in range(1000):
+            seq = _SEQ.unpack_from(buf)[0]
+            if seq & 1:
+                continue
+            fields = _LAYOUT.unpack_from(buf)
+            if _SEQ.unpack_from(buf)[0] == seq:
+                break
+        else:
+            return None
+        if fields[0] == 0 or time.time_ns() - fields[1] > STALE_NS:
+            self.close()
+            return None
+        return fields
+
+    @property
+    def connected(self) -> bool:
+        return self.read() is not None
+
+    @traced
+    def now(self) -> ClockState:
+        now_us = self.context.clock.now_us()
+        fields = self.read()
+        if fields is not None:
+            _, _, revision, start, end, total_day, stage, cycle, day, _ = fields
+            if start <= now_us < end:
+                return ClockState(now_us, total_day, stage, cycle, day, start, end, revision)
+        return ClockState.from_context(self.context, now_us)
+
+    @traced
+    def command(self, name: str, **kwargs):
+        func = COMMANDS.get(name)
+        if func is None:
+            raise ValueError("没有这个命令", name)
+        reply = _request(self.socket_path, {"command": name, "args": kwargs})
+        if reply is None:
+            return func(self.context, **kwargs)
+        if not reply["ok"]:
+            raise DaemonError(reply["error"])
+        return reply.get("result")
+
+    def stop_daemon(self) -> bool:
+        return _request(self.socket_path, {"command": "stop"}) is not None
+
+
+def main(argv=None):
+    import mytime
+    import path_def
+    path_def.init_path(__file__)
+
+    parser = argparse.ArgumentParser(description="本钟的守护进程和命令行客户端")
+    parser.add_argument("--save", type=Path, help="保存文件，默认和窗口程序用同一个")
+    sub = parser.add_subparsers(dest="action", required=True)
+    sub.add_parser("serve", help="启动守护进程")
+    sub.add_parser("stop", help="让守护进程退出")
+    sub.add_parser("now", help="显示现在的时间")
+    p = sub.add_parser("good_night")
+    p.add_argument("--minutes", type=float, default=40)
+    p = sub.add_parser("set_today_hours")
+    p.add_argument("hours", type=float)
+    for name in ("today_is_yesterday", "undo", "redo"):
+        sub.add_parser(name)
+    args = parser.parse_args(argv)
+
+    if args.save:
+        mytime.Default_File_Path = args.save
+    if args.action == "serve":
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+        daemon = ClockDaemon(command.default_context())
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return
+
+    client = DaemonClient()
+    if args.action == "stop":
+        if not client.stop_daemon():
+            print("守护进程没有在运行", file=sys.stderr)
+    elif args.action == "now":
+        state = client.now()
+        print(f"{state}  今天有{state.day_length.total_seconds() / 3600:.1f}小时，"
+              f"还剩{state.remaining.total_seconds() / 3600:.1f}小时")
+    else:
+        kwargs = {k: v for k, v in vars(args).items() if k not in ("save", "action")}
+        result = client.command(args.action, **kwargs)
+        if result is not None:
+            print(result)
+
+
+if __name__ == '__main__':
+    main()
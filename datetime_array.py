@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+# @File    : datetime_array.py
+# @Date    : 2026-10-19
+# @Author  : 王超逸
+# @Brief   : 按列存储的一组MyDateTime
+from __future__ import annotations
+
+import operator
+from array import array
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from typing import Iterable
+
+from mytime import MyDateTime, DatetimeContext, SubjectiveDelta, US_PER_SEC, sec_to_us, datetime_to_us, is_aware
+import zones
+
+_ONE_US = timedelta(microseconds=1)
+_FIELDS = ("total_day", "stage", "cycle", "day", "hour", "minute", "second", "microsecond")
+
+
+class MyDateTimeArray:
+    """
+    一组同一历法下的时间，底层只是一个微秒时间戳的array和一个DatetimeContext。
+
+    和MyDateTime一样，时间戳是不变的，day_time_map变化之后各个字段会跟着变。
+    字段在第一次访问时整列算出来，day_time_map的revision变了就重新算
+    """
+
+    def __init__(self, timestamps_us: Iterable[int] = (), context=...):
+        if context is ...:
+            context = MyDateTime.get_default_context()
+        self._context: DatetimeContext = context
+        self._data = timestamps_us if isinstance(timestamps_us, array) else array("q", timestamps_us)
+        self._fields = None
+        self._fields_revision = None
+
+    @classmethod
+    def from_timestamps(cls, timestamps: Iterable[float], context=...):
+        return cls(array("q", map(sec_to_us, timestamps)), context)
+
+    @classmethod
+    def from_datetimes(cls, datetimes: Iterable[datetime | MyDateTime], context=...):
+        data = array("q")
+        for dt in datetimes:
+            if isinstance(dt, MyDateTime):
+                data.append(dt.timestamp_us())
+            elif is_aware(dt):
+                data.append(datetime_to_us(dt))
+            else:
+                raise TypeError("必须是带有时区的绝对时间")
+        return cls(data, context)
+
+    def _new(self, data: array) -> MyDateTimeArray:
+        return type(self)(data, self._context)
+
+    @property
+    def context(self):
+        return self._context
+
+    @property
+    def timestamps_us(self) -> array:
+        return array("q", self._data)
+
+    def timestamps(self) -> list[float]:
+        return [t / US_PER_SEC for t in self._data]
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        context = self._context
+        for t in self._data:
+            yield MyDateTime.from_timestamp_us(t, context)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._new(self._data[index])
+        return MyDateTime.from_timestamp_us(self._data[index], self._context)
+
+    def __repr__(self):
+        if len(self) > 6:
+            items = [str(x) for x in self[:3]] + ["..."] + [str(x) for x in self[-3:]]
+        else:
+            items = [str(x) for x in self]
+        return f"<MyDateTimeArray len={len(self)} [{', '.join(items)}]>"
+
+    ##################################################
+    # 字段
+
+    def _calc_fields(self):
+        context = self._context
+        file_cache = context._file_cache
+        day_time_list = file_cache.file_data
+        zero_point = file_cache.get_zero_point(context.zero_point_us)
+        last_time, last_day = file_cache.get_last_time_last_day(context.zero_point_us)
+        default_day_us = context.default_day_us
+        day_per_cycle = context.day_per_cycle
+        cycle_per_stage = context.cycle_per_stage
+
+        fields = {name: array("q") for name in _FIELDS}
+        total_day_a, stage_a, cycle_a, day_a, hour_a, minute_a, second_a, us_a = \
+            (fields[name].append for name in _FIELDS)
+        for t in self._data:
+            if t < zero_point:
+                raise ValueError("纪元前时间无定义", t)
+            if t < last_time:
+                total_day = bisect_right(day_time_list, t) - 1
+                t -= day_time_list[total_day]
+            else:
+                total_day, t = divmod(t - last_time, default_day_us)
+                total_day += last_day
+            t, us = divmod(t, US_PER_SEC)
+            t, ss = divmod(t, 60)
+            hh, mm = divmod(t, 60)
+            s, d = divmod(total_day, day_per_cycle)
+            s, c = divmod(s, cycle_per_stage)
+            total_day_a(total_day)
+            stage_a(s + 1)
+            cycle_a(c + 1)
+            day_a(d + 1)
+            hour_a(hh)
+            minute_a(mm)
+            second_a(ss)
+            us_a(us)
+        return fields
+
+    def _field(self, name) -> array:
+        revision = self._context._file_cache.revision
+        if self._fields is None or self._fields_revision != revision:
+            self._fields = self._calc_fields()
+            self._fields_revision = revision
+        return self._fields[name]
+
+    @property
+    def total_day(self) -> array:
+        """从纪元开始的第几天，从0开始"""
+        return self._field("total_day")
+
+    @property
+    def stage(self) -> array:
+        return self._field("stage")
+
+    @property
+    def cycle(self) -> array:
+        return self._field("cycle")
+
+    @property
+    def day(self) -> array:
+        return self._field("day")
+
+    @property
+    def hour(self) -> array:
+        return self._field("hour")
+
+    @property
+    def minute(self) -> array:
+        return self._field("minute")
+
+    @property
+    def second(self) -> array:
+        return self._field("second")
+
+    @property
+    def microsecond(self) -> array:
+        return self._field("microsecond")
+
+    ##################################################
+    # 本地时间
+
+    def wall_fields(self, zone=None) -> dict[str, array]:
+        """
+        换算成某个时区的本地时间，字段见zones.WALL_FIELDS，每个字段一个array。
+        zone可以是一个时区，也可以是和数组等长的一组时区，每个元素用各自的
+        """
+        if isinstance(zone, (list, tuple)) and len(zone) != len(self):
+            raise ValueError("长度不一致", len(self), len(zone))
+        return zones.wall_fields(self._data, zone)
+
+    def isoformats(self, zone=None) -> list[str]:
+        """每个元素在本地时间下的ISO 8601字符串，zone和wall_fields一样"""
+        if isinstance(zone, (list, tuple)) and len(zone) != len(self):
+            raise ValueError("长度不一致", len(self), len(zone))
+        return zones.isoformats(self._data, zone)
+
+    def to_datetimes(self, zone=None) -> list[datetime]:
+        zone = zones.get_zone(zone)
+        return [zone.to_datetime(t) for t in self._data]
+
+    ##################################################
+    # 运算
+
+    def _other_us(self, other):
+        """把另一个操作数变成逐元素的微秒时间戳，标量返回int，数组返回array"""
+        if isinstance(other, MyDateTimeArray):
+            if len(other) != len(self):
+                raise ValueError("长度不一致", len(self), len(other))
+            return other._data
+        if isinstance(other, MyDateTime):
+            return other.timestamp_us()
+        if isinstance(other, datetime):
+            if is_aware(other):
+                return datetime_to_us(other)
+            raise TypeError("必须是带有时区的绝对时间")
+        raise TypeError("不支持比较")
+
+    def _shift_days(self, delta: SubjectiveDelta) -> array:
+        """
+        每个元素按SubjectiveDelta移动。各元素的第几天用缓存的total_day列，
+        目标那天的开始直接按下标取或者外推，不再做二分查找
+        """
+        context = self._context
+        file_cache = context._file_cache
+        day_time_list = file_cache.file_data
+        last_time, last_day = file_cache.get_last_time_last_day(context.zero_point_us)
+        default_day_us = context.default_day_us
+        n = delta.total_days(context)
+        offset = delta.microseconds
+
+        def day_start(day):
+            if day >= last_day:
+                return last_time + (day - last_day) * default_day_us
+            return day_time_list[day]
+
+        out = array("q")
+        append = out.append
+        for total_day, t in zip(self.total_day, self._data):
+            day = total_day + n
+            if day < 0:
+                raise ValueError("纪元前时间无定义", day)
+            append(day_start(day) + t - day_start(total_day) + offset)
+        return out
+
+    def __add__(self, other: timedelta | SubjectiveDelta):
+        if isinstance(other, SubjectiveDelta):
+            return self._new(self._shift_days(other))
+        if not isinstance(other, timedelta):
+            return NotImplemented
+        delta = other // _ONE_US
+        return self._new(array("q", [t + delta for t in self._data]))
+
+    __radd__ = __add__
+
+    def __sub__(self, other: timedelta | SubjectiveDelta | MyDateTimeArray | MyDateTime | datetime):
+        """
+        减去timedelta或者SubjectiveDelta得到新的数组；减去时间（或者等长的时间数组）得到逐元素相差的微秒数
+        """
+        if isinstance(other, SubjectiveDelta):
+            return self._new(self._shift_days(-other))
+        if isinstance(other, timedelta):
+            delta = other // _ONE_US
+            return self._new(array("q", [t - delta for t in self._data]))
+        other = self._other_us(other)
+        if isinstance(other, int):
+            return array("q", [t - other for t in self._data])
+        return array("q", [a - b for a, b in zip(self._data, other)])
+
+    def __rsub__(self, other: MyDateTime | datetime):
+        other = self._other_us(other)
+        return array("q", [other - t for t in self._data])
+
+    def _compare(self, other, op) -> list[bool]:
+        other = self._other_us(other)
+        if isinstance(other, int):
+            return [op(t, other) for t in self._data]
+        return [op(a, b) for a, b in zip(self._data, other)]
+
+    def __lt__(self, other):
+        return self._compare(other, operator.lt)
+
+    def __le__(self, other):
+        return self._compare(other, operator.le)
+
+    def __gt__(self, other):
+        return self._compare(other, operator.gt)
+
+    def __ge__(self, other):
+        return self._compare(other, operator.ge)
+
+    def __eq__(self, other):
+        return self._compare(other, operator.eq)
+
+    def __ne__(self, other):
+        return self._compare(other, operator.ne)
+
+    __hash__ = None
+
+    def argsort(self, reverse=False) -> list[int]:
+        data = self._data
+        return sorted(range(len(data)), key=data.__getitem__, reverse=reverse)
+
+    def sorted(self, reverse=False) -> MyDateTimeArray:
+        return self._new(array("q", sorted(self._data, reverse=reverse)))
+
+    def take(self, indices: Iterable[int]) -> MyDateTimeArray:
+        data = self._data
+        return self._new(array("q", [data[i] for i in indices]))
+
+    def min(self) -> MyDateTime:
+        return MyDateTime.from_timestamp_us(min(self._data), self._context)
+
+    def max(self) -> MyDateTime:
+        return MyDateTime.from_timestamp_us(max(self._data), self._context)
+
+
+__all__ = ["MyDateTimeArray"]
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# @File    : day_stats.py
+# @Date    : 2026-10-19
+# @Author  : 王超逸
+# @Brief   : 最近若干天实际长度的滚动统计
+from __future__ import annotations
+
+from bisect import insort, bisect_left
+from typing import Sequence
+
+
+class DayLengthStats:
+    """
+    最近window天的实际长度（微秒）的均值、中位数、分位数和趋势。
+
+    每追加或者弹出一个分界点只做常数次更新（窗口内的有序表长度固定，不随历史增长）；
+    day_time_map变了之后找改动的位置是整段比较，不会逐个重新计算整个历史
+    """
+
+    def __init__(self, window: int = 28):
+        if window < 1:
+            raise ValueError("window must be at least 1", window)
+        self.window = window
+        # 已经读入的分界点，用来和day_time_map比较，找出改动的位置
+        self._bounds: list[int] = []
+        # 每天的长度，_lengths[k] = _bounds[k + 1] - _bounds[k]
+        self._lengths: list[int] = []
+        # 窗口内的长度，有序
+        self._sorted: list[int] = []
+        # 窗口内的累加量，x是天的下标，y是长度。全部是整数，没有误差
+        self._n = 0
+        self._sum_x = 0
+        self._sum_y = 0
+        self._sum_xx = 0
+        self._sum_xy = 0
+        self._sum_yy = 0
+        self._revision = None
+
+    def _add(self, x: int, y: int):
+        insort(self._sorted, y)
+        self._n += 1
+        self._sum_x += x
+        self._sum_y += y
+        self._sum_xx += x * x
+        self._sum_xy += x * y
+        self._sum_yy += y * y
+
+    def _remove(self, x: int, y: int):
+        del self._sorted[bisect_left(self._sorted, y)]
+        self._n -= 1
+        self._sum_x -= x
+        self._sum_y -= y
+        self._sum_xx -= x * x
+        self._sum_xy -= x * y
+        self._sum_yy -= y * y
+
+    def push(self, boundary: int):
+        """追加一个分界点"""
+        if self._bounds:
+            if boundary <= self._bounds[-1]:
+                raise ValueError("分界点必须严格递增", self._bounds[-1], boundary)
+            x = len(self._lengths)
+            self._lengths.append(boundary - self._bounds[-1])
+            self._add(x, self._lengths[x])
+            old = x - self.window
+            if old >= 0:
+                self._remove(old, self._lengths[old])
+        self._bounds.append(boundary)
+
+    def pop(self):
+        """弹出最后一个分界点"""
+        boundary = self._bounds.pop()
+        if self._lengths:
+            x = len(self._lengths) - 1
+            self._remove(x, self._lengths.pop())
+            old = x - self.window
+            if old >= 0:
+                self._add(old, self._lengths[old])
+        return boundary
+
+    def sync(self, day_time_list: Sequence[int], revision=None):
+        """
+        和day_time_map对齐：从前往后找到第一个不同的分界点，只重做它之后的部分。revision没变则什么也不做。
+
+        不能从后往前找第一个相同的：合并、重新读取可能改的是中间，尾巴不变。
+        找的时候用切片整段比较，在C里做，二分缩小范围，总共只过一遍
+        """
+        if revision is not None and revision == self._revision:
+            return
+        bounds = self._bounds
+        n = min(len(bounds), len(day_time_list))
+        i = n
+        if bounds[:n] != day_time_list[:n]:
+            # 前i个相同，前hi个不同
+            i, hi = 0, n
+            while hi - i > 1:
+                mid = (i + hi) // 2
+                if bounds[i:mid] == day_time_list[i:mid]:
+                    i = mid
+                else:
+                    hi = mid
+        while len(bounds) > i:
+            self.pop()
+        for k in range(i, len(day_time_list)):
+            self.push(day_time_list[k])
+        self._revision = revision
+
+    def __len__(self):
+        """窗口内有多少天"""
+        return self._n
+
+    @property
+    def total_days(self):
+        return len(self._lengths)
+
+    @property
+    def mean(self) -> float | None:
+        if not self._n:
+            return None
+        return self._sum_y / self._n
+
+    @property
+    def stdev(self) -> float | None:
+        if not self._n:
+            return None
+        n = self._n
+        return max(0, n * self._sum_yy - self._sum_y * self._sum_y) ** 0.5 / n
+
+    def percentile(self, p: float) -> float | None:
+        """p在0到100之间，线性插值"""
+        if not self._n:
+            return None
+        if not 0 <= p <= 100:
+            raise ValueError("p must be in 0..100", p)
+        pos = (self._n - 1) * p / 100
+        lo = int(pos)
+        hi = min(lo + 1, self._n - 1)
+        return self._sorted[lo] + (self._sorted[hi] - self._sorted[lo]) * (pos - lo)
+
+    @property
+    def median(self) -> float | None:
+        return self.percentile(50)
+
+    @property
+    def trend(self) -> float:
+        """最小二乘拟合的斜率，每过一天长度变化多少微秒"""
+        n = self._n
+        denominator = n * self._sum_xx - self._sum_x * self._sum_x
+        if n < 2 or denominator == 0:
+            return 0.
+        return (n * self._sum_xy - self._sum_x * self._sum_y) / denominator
+
+    def predict(self, method="median") -> float | None:
+        """
+        预测下一天的长度（微秒）。median对熬夜这种偶然的长天不敏感；
+        trend用拟合的直线外推一天，结果限制在窗口的最小值和最大值之间
+        """
+        if not self._n:
+            return None
+        if method == "median":
+            return self.median
+        if method == "mean":
+            return self.mean
+        if method == "trend":
+            n = self._n
+            slope = self.trend
+            intercept = (self._sum_y - slope * self._sum_x) / n
+            value = intercept + slope * len(self._lengths)
+            return min(max(value, self._sorted[0]), self._sorted[-1])
+        raise ValueError("unknown method", method)
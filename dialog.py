@@ -7,8 +7,10 @@
 # @Brief   :
 
 from generated_ui.set_hour_today_ui import Ui_Dialog as SetHourTodayUI
-from PyQt5.QtWidgets import QDialog
+from PyQt5.QtWidgets import QDialog, QLabel
 import command
+from clock_state import ClockState
+from mytime import OverlayConflictError
 
 
 class SetHourTodayDialog(QDialog):
@@ -16,8 +18,16 @@ class SetHourTodayDialog(QDialog):
         super().__init__(parent)
         self.ui = SetHourTodayUI()
         self.ui.setupUi(self)
+        # 生成的代码把确定直接连到了accept上，不合法时对话框不能关掉，只留自己的
+        self.ui.buttonBox.accepted.disconnect()
         self.ui.buttonBox.accepted.connect(self.accepted)
         self.ui.buttonBox.rejected.connect(lambda: self.close())
+        # 改小时数时在草稿上预览结果，点确定才写进保存文件
+        self.overlay = None
+        self.preview_label = QLabel(self)
+        self.preview_label.setFont(self.ui.label.font())
+        self.ui.horizontalLayout.insertWidget(3, self.preview_label)
+        self.ui.doubleSpinBox.valueChanged.connect(self.preview)
 
     def exec(self):
         from mytime import MyDateTime
@@ -29,10 +39,49 @@ class SetHourTodayDialog(QDialog):
         else:
             pre_day = MyDateTime(t.stage, t.cycle, t.day - 1, skip_check=True)
             hours = (today - pre_day).total_seconds() / 3600
+        self.overlay = command.default_context().overlay()
         self.ui.doubleSpinBox.setValue(hours)
-        super().exec()
+        self.preview(hours)
+        try:
+            super().exec()
+        finally:
+            self.overlay.discard()
+            self.overlay = None
 
+    def preview(self, hours):
+        overlay = self.overlay
+        if overlay is None:
+            return
+        try:
+            command.preview_today_hours(hours, overlay)
+        except ValueError:
+            self.preview_label.setText("不合法")
+            return
+        state = ClockState.from_context(overlay, overlay.clock.now_us())
+        minutes = int(state.remaining.total_seconds() // 60)
+        self.preview_label.setText(f"现在{state.hour:02d}:{state.minute:02d} 还剩{minutes // 60}时{minutes % 60}分")
 
     def accepted(self):
-        command.set_today_hours(self.ui.doubleSpinBox.value())
+        hours = self.ui.doubleSpinBox.value()
+        try:
+            self.apply(hours)
+        except ValueError:
+            # 比如0小时，今天的结束时刻和开始时刻一样，提交时检查不通过，什么也没改
+            self.preview_label.setText("不合法")
+            return
         self.close()
+
+    def apply(self, hours):
+        overlay = self.overlay
+        if overlay is None:
+            command.set_today_hours(hours)
+        else:
+            # 预览时没有记日志，这里在草稿上正式执行一次再提交
+            overlay.discard()
+            command.set_today_hours(hours, context=overlay)
+            try:
+                overlay.commit()
+            except OverlayConflictError:
+                # 预览期间别的地方改过，在新的数据上重新算一遍，上面已经记过日志了
+                command.preview_today_hours(hours, overlay)
+                overlay.commit()
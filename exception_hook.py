@@ -5,27 +5,179 @@
 # @Author  : 王超逸
 # @Brief   :
 
+import atexit
+import collections
+import logging
+import logging.handlers
+import queue
 import sys
+import threading
+import time
 import traceback
-import logging
+from pathlib import Path
+
 from PyQt5 import QtCore, QtWidgets
 
 # basic logger functionality
 log = logging.getLogger(__name__)
-handler = logging.StreamHandler(stream=sys.stdout)
-log.addHandler(handler)
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s [%(threadName)s] %(message)s"
+LOG_FILE_MAX_BYTES = 1024 * 1024
+LOG_FILE_BACKUP_COUNT = 3
+RING_BUFFER_SIZE = 500
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    默认的QueueHandler会在调用的线程上格式化消息，这里原样放进队列，格式化全部交给后台线程。
+    记录只在本进程内传递，不需要序列化
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class RingBufferHandler(logging.Handler):
+    """
+    在内存中保留最近的若干条记录，崩溃时和报告一起写出来
+    """
+
+    def __init__(self, capacity=RING_BUFFER_SIZE):
+        super().__init__(logging.DEBUG)
+        self.buffer = collections.deque(maxlen=capacity)
+
+    def emit(self, record):
+        try:
+            self.buffer.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+    def dump(self):
+        self.acquire()
+        try:
+            return list(self.buffer)
+        finally:
+            self.release()
+
+
+class CrashReportHandler(logging.Handler):
+    """
+    收到CRITICAL的记录时，在日志文件夹中写一份崩溃报告，附上ring buffer中最近的记录。
+    一连串的错误只写第一份，之后的在min_interval秒内只计数，它们仍然会写进普通的日志
+    """
+
+    def __init__(self, log_dir: Path, ring_buffer: RingBufferHandler, min_interval=10.):
+        super().__init__(logging.CRITICAL)
+        self.log_dir = log_dir
+        self.ring_buffer = ring_buffer
+        self.min_interval = min_interval
+        self._last_report = None
+        self._suppressed = 0
+
+    def emit(self, record):
+        if self._last_report is not None and record.created - self._last_report < self.min_interval:
+            self._suppressed += 1
+            return
+        self._last_report = record.created
+        try:
+            name = time.strftime("crash-%Y%m%d-%H%M%S", time.localtime(record.created))
+            path = self.log_dir / f"{name}.log"
+            with path.open("wt", encoding="utf-8") as fp:
+                if self._suppressed:
+                    fp.write(f"(上一份报告之后还有{self._suppressed}个错误，见timer.log)\n\n")
+                fp.write(self.format(record))
+                fp.write("\n\n---- recent events ----\n")
+                fp.write("\n".join(self.ring_buffer.dump()))
+                fp.write("\n")
+            self._suppressed = 0
+        except Exception:
+            self.handleError(record)
+
+
+log_queue = queue.SimpleQueue()
+ring_buffer = RingBufferHandler()
+ring_buffer.setFormatter(logging.Formatter(LOG_FORMAT))
+_listener = None
+
+# 在start_logging之前产生的记录先留在队列里，等监听线程启动后再处理
+_root_logger = logging.getLogger()
+_root_logger.addHandler(_DeferredQueueHandler(log_queue))
+_root_logger.setLevel(logging.DEBUG)
+
+
+def start_logging(log_dir: Path):
+    """
+    启动后台的日志线程：写入按大小滚动的日志文件、ring buffer，有控制台的话也输出到控制台
+    """
+    global _listener
+    if _listener is not None:
+        return
+    log_dir.mkdir(parents=True, exist_ok=True)
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [ring_buffer]
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_dir / "timer.log", maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUP_COUNT,
+        encoding="utf-8", delay=True)
+    file_handler.setLevel(logging.INFO)
+    handlers.append(file_handler)
+
+    crash_handler = CrashReportHandler(log_dir, ring_buffer)
+    handlers.append(crash_handler)
+
+    # 打包成窗口程序之后没有stdout
+    if sys.stdout is not None:
+        stream_handler = logging.StreamHandler(stream=sys.stdout)
+        stream_handler.setLevel(logging.INFO)
+        handlers.append(stream_handler)
+
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class _ExceptionBox:
+    """
+    同一时间只有一个错误对话框。对话框开着的时候再来的错误只计数，不再弹新的
+    """
+
+    def __init__(self):
+        self.box = None
+        self.suppressed = 0
+
+    def show(self, log_msg):
+        if QtWidgets.QApplication.instance() is None:
+            log.debug("No QApplication instance available.")
+            return
+        if self.box is not None and self.box.isVisible():
+            self.suppressed += 1
+            self.box.setInformativeText(f"之后又发生了{self.suppressed}个错误，详见日志文件夹")
+            return
+        self.suppressed = 0
+        self.box = QtWidgets.QMessageBox()
+        self.box.setIcon(QtWidgets.QMessageBox.Critical)
+        self.box.setText("Oops. An unexpected error occured:\n{0}".format(log_msg))
+        # 不用exec_，不阻塞事件循环
+        self.box.open()
+
+
+_exception_box = _ExceptionBox()
 
 
 def show_exception_box(log_msg):
     """Checks if a QApplication instance is available and shows a messagebox with the exception message.
     If unavailable (non-console application), log an additional notice.
     """
-    if QtWidgets.QApplication.instance() is not None:
-        errorbox = QtWidgets.QMessageBox()
-        errorbox.setText("Oops. An unexpected error occured:\n{0}".format(log_msg))
-        errorbox.exec_()
-    else:
-        log.debug("No QApplication instance available.")
+    _exception_box.show(log_msg)
 
 
 class UncaughtHook(QtCore.QObject):
@@ -35,6 +187,7 @@ class UncaughtHook(QtCore.QObject):
         super(UncaughtHook, self).__init__(*args, **kwargs)
         # this registers the exception_hook() function as hook with the Python interpreter
         sys.excepthook = self.exception_hook
+        threading.excepthook = self.thread_exception_hook
 
         # connect signal to execute the message box function always on main thread
         self._exception_caught.connect(show_exception_box)
@@ -55,6 +208,11 @@ class UncaughtHook(QtCore.QObject):
             # trigger message box show
             self._exception_caught.emit(log_msg)
 
+    def thread_exception_hook(self, args):
+        if args.exc_type is SystemExit:
+            return
+        self.exception_hook(args.exc_type, args.exc_value, args.exc_traceback)
+
 
 # create a global instance of our class to register the hook
-qt_exception_hook = UncaughtHook()
\ No newline at end of file
+qt_exception_hook = UncaughtHook()
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# @File    : export.py
+# @Date    : 2026-10-19
+# @Author  : 王超逸
+# @Brief   : 把本钟的每一天导出成iCalendar或者CSV，边算边写，不在内存里攒结果
+from __future__ import annotations
+
+import argparse
+import csv
+import functools
+import sys
+import time
+from datetime import timedelta, tzinfo
+from typing import Iterator, NamedTuple, TextIO
+
+from mytime import MyDateTime, DatetimeContext, US_PER_SEC
+from zones import Zone, get_zone
+
+
+class DayRecord(NamedTuple):
+    total_day: int
+    stage: int
+    cycle: int
+    day: int
+    start_us: int
+    end_us: int
+    # 是否是往后外推出来的
+    forecast: bool
+
+
+def iter_days(context: DatetimeContext = ..., future: timedelta = timedelta(days=365),
+              now_us: int = ...) -> Iterator[DayRecord]:
+    """
+    从纪元开始，逐天给出每一天的起止时间，一直到现在之后future这么久。
+    只顺序扫一遍day_time_map，月-周-日用计数器进位得到，不构造MyDateTime
+    """
+    if context is ...:
+        context = MyDateTime.get_default_context()
+    if now_us is ...:
+        now_us = context.clock.now_us()
+    until = now_us + future // timedelta(microseconds=1)
+    day_per_cycle = context.day_per_cycle
+    cycle_per_stage = context.cycle_per_stage
+    default_day_us = context.default_day_us
+    file_cache = context._file_cache
+    day_time_list = file_cache.file_data
+    last_time, last_day = file_cache.get_last_time_last_day(context.zero_point_us)
+
+    stage, cycle, day = 1, 1, 1
+    total_day = 0
+    start = file_cache.get_zero_point(context.zero_point_us)
+    forecast = False
+    while start < until:
+        if total_day < last_day:
+            end = day_time_list[total_day + 1]
+        else:
+            end = start + default_day_us
+            forecast = end > now_us
+        yield DayRecord(total_day, stage, cycle, day, start, end, forecast)
+        total_day += 1
+        start = end
+        day += 1
+        if day > day_per_cycle:
+            day = 1
+            cycle += 1
+            if cycle > cycle_per_stage:
+                cycle = 1
+                stage += 1
+
+
+def _ics_time(t_us: int) -> str:
+    return time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(t_us // US_PER_SEC))
+
+
+def write_ics(fp: TextIO, context: DatetimeContext = ..., future: timedelta = timedelta(days=365)) -> int:
+    """
+    写成iCalendar，每个本钟的日子是一个VEVENT，标题是“月-周-日”。返回写了多少天
+    """
+    stamp = _ics_time(time.time_ns() // 1000)
+    write = fp.write
+    write("BEGIN:VCALENDAR\r\n"
+          "VERSION:2.0\r\n"
+          "PRODID:-//Self-centered-Timer//CN\r\n"
+          "CALSCALE:GREGORIAN\r\n"
+          "X-WR-CALNAME:唯心主义者时钟\r\n")
+    n = 0
+    for record in iter_days(context, future):
+        write(f"BEGIN:VEVENT\r\n"
+              f"UID:day-{record.total_day}@self-centered-timer\r\n"
+              f"DTSTAMP:{stamp}\r\n"
+              f"DTSTART:{_ics_time(record.start_us)}\r\n"
+              f"DTEND:{_ics_time(record.end_us)}\r\n"
+              f"SUMMARY:{record.stage}-{record.cycle}-{record.day}\r\n"
+              f"STATUS:{'TENTATIVE' if record.forecast else 'CONFIRMED'}\r\n"
+              f"TRANSP:TRANSPARENT\r\n"
+              f"END:VEVENT\r\n")
+        n += 1
+    write("END:VCALENDAR\r\n")
+    return n
+
+
+def write_csv(fp: TextIO, context: DatetimeContext = ..., future: timedelta = timedelta(days=365),
+              tzinfo_: Zone | tzinfo | str = None) -> int:
+    """
+    写成CSV，一天一行，时间是ISO 8601格式，默认用本地时区（每个时刻用各自的偏移）。返回写了多少天
+    """
+    isoformat = get_zone(tzinfo_).isoformat
+    # 记录是按时间顺序来的，只记上一次的日期就够了
+    last_day = [None, None]
+    writer = csv.writer(fp, lineterminator="\n")
+    writer.writerow(["stage", "cycle", "day", "total_day", "start", "end", "hours", "forecast"])
+    n = 0
+    for record in iter_days(context, future):
+        writer.writerow([
+            record.stage, record.cycle, record.day, record.total_day,
+            isoformat(record.start_us, last_day),
+            isoformat(record.end_us, last_day),
+            f"{(record.end_us - record.start_us) / (3600 * US_PER_SEC):.3f}",
+            int(record.forecast),
+        ])
+        n += 1
+    return n
+
+
+def main(argv=None):
+    import path_def
+    path_def.init_path(__file__)
+
+    parser = argparse.ArgumentParser(description="导出本钟的日历")
+    parser.add_argument("format", choices=["ics", "csv"])
+    parser.add_argument("-o", "--output", help="输出文件，默认输出到stdout")
+    parser.add_argument("--future-days", type=float, default=365, help="往后预测多少天")
+    parser.add_argument("--tz", help="csv用的时区，IANA时区名，默认是本地时区")
+    args = parser.parse_args(argv)
+
+    future = timedelta(days=args.future_days)
+    if args.format == "ics":
+        writer = write_ics
+    else:
+        writer = functools.partial(write_csv, tzinfo_=args.tz)
+    if args.output:
+        with open(args.output, "wt", encoding="utf-8", newline="") as fp:
+            writer(fp, future=future)
+    else:
+        writer(sys.stdout, future=future)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# @File    : file_lock.py
+# @Date    : 2026-10-19
+# @Author  : 王超逸
+# @Brief   : 跨进程的建议锁，windows下用msvcrt，其他平台用fcntl
+from __future__ import annotations
+
+import os
+import threading
+import time
+from pathlib import Path
+
+if os.name == "nt":
+    import msvcrt
+
+
+    def _lock_fd(fd):
+        # msvcrt.locking自己只重试10次，每次1秒，超时就抛异常，所以这里一直重试到拿到为止
+        while True:
+            try:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                time.sleep(0.001)
+
+
+    def _unlock_fd(fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+
+    def _lock_fd(fd):
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+
+    def _unlock_fd(fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+class FileLock:
+    """
+    锁文件。同一进程内可重入，不同进程之间互斥
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._fd = None
+        self._depth = 0
+        self._thread_lock = threading.RLock()
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        try:
+            if self._depth == 0:
+                if not self.path.parent.exists():
+                    self.path.parent.mkdir(parents=True, exist_ok=True)
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    _lock_fd(fd)
+                except BaseException:
+                    os.close(fd)
+                    raise
+                self._fd = fd
+            self._depth += 1
+        except BaseException:
+            self._thread_lock.release()
+            raise
+
+    def release(self):
+        try:
+            self._depth -= 1
+            if self._depth == 0:
+                fd, self._fd = self._fd, None
+                try:
+                    _unlock_fd(fd)
+                finally:
+                    os.close(fd)
+        finally:
+            self._thread_lock.release()
+
+    @property
+    def locked(self):
+        return self._depth > 0
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
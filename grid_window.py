@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# @File    : grid_window.py
+# @Date    : 2026-10-19
+# @Author  : 王超逸
+# @Brief   : 显示这个月每一天的窗口
+from __future__ import annotations
+
+from PyQt5.QtCore import Qt, QRect, QEvent
+from PyQt5.QtGui import QFont, QPainter, QColor
+from PyQt5.QtWidgets import QWidget
+
+import tick
+from stage_grid import StageGrid
+from zones import get_zone
+
+CELL_WIDTH = 130
+CELL_HEIGHT = 70
+HEADER_HEIGHT = 36
+PADDING = 6
+
+
+class StageGridWindow(QWidget):
+    """
+    cycle_per_stage行、day_per_cycle列，每格是一天：第几周第几天、实际开始的时间、这一天有多长，
+    今天的格子画出过去了多少。每秒检查一次，只重画有变化的格子和今天的格子
+    """
+
+    def __init__(self, context=..., parent=None, dispatcher: tick.TickDispatcher = None):
+        super().__init__(parent, Qt.Window)
+        self.setWindowTitle("这个月")
+        self.grid = StageGrid(context)
+        self.grid.refresh()
+        self._current = None
+        self._title_font = QFont("Microsoft Yahei UI", 14)
+        self._font = QFont("Microsoft Yahei UI", 11)
+        self._small_font = QFont("Microsoft Yahei UI", 9)
+        self.setFixedSize(self.grid.columns * CELL_WIDTH, HEADER_HEIGHT + self.grid.rows * CELL_HEIGHT)
+
+        self.dispatcher = dispatcher or tick.shared()
+        self.subscription = self.dispatcher.subscribe(lambda state: self.tick(), self.grid.context)
+        self.dispatcher.set_active(self.subscription, False)
+
+    def cell_rect(self, index: int) -> QRect:
+        row, column = divmod(index, self.grid.columns)
+        return QRect(column * CELL_WIDTH, HEADER_HEIGHT + row * CELL_HEIGHT, CELL_WIDTH, CELL_HEIGHT)
+
+    def tick(self):
+        grid = self.grid
+        stage = grid.stage
+        changed = grid.refresh()
+        if grid.stage != stage:
+            self._current = None
+            self.update()
+            return
+        current = grid.index_of(grid.context.clock.now_us())
+        changed |= {i for i in (self._current, current) if i is not None}
+        self._current = current
+        for i in changed:
+            self.update(self.cell_rect(i))
+
+    def paintEvent(self, event):
+        grid = self.grid
+        now_us = grid.context.clock.now_us()
+        region = event.region()
+        painter = QPainter(self)
+        painter.fillRect(event.rect(), self.palette().window())
+
+        header = QRect(0, 0, self.width(), HEADER_HEIGHT)
+        if region.intersects(header):
+            painter.setFont(self._title_font)
+            painter.drawText(header, Qt.AlignCenter, f"第{grid.stage}月")
+
+        for i, cell in enumerate(grid.cells):
+            rect = self.cell_rect(i)
+            if not region.intersects(rect):
+                continue
+            inner = rect.adjusted(PADDING // 2, PADDING // 2, -PADDING // 2, -PADDING // 2)
+            progress = cell.progress(now_us)
+            if 0 < progress < 1:
+                # 今天
+                painter.fillRect(inner, QColor(255, 220, 240))
+                done = QRect(inner)
+                done.setWidth(round(inner.width() * progress))
+                painter.fillRect(done, QColor(255, 180, 220))
+            elif progress >= 1:
+                painter.fillRect(inner, QColor(235, 235, 235))
+            painter.setPen(self.palette().windowText().color())
+            painter.drawRect(inner)
+
+            text_rect = inner.adjusted(PADDING, PADDING // 2, -PADDING, -PADDING // 2)
+            painter.setFont(self._font)
+            painter.drawText(text_rect, Qt.AlignLeft | Qt.AlignTop, f"{cell.cycle}-{cell.day}")
+            painter.setFont(self._small_font)
+            start = get_zone().to_datetime(cell.start_us).strftime("%m-%d %H:%M")
+            painter.drawText(text_rect, Qt.AlignRight | Qt.AlignTop, start)
+            painter.drawText(text_rect, Qt.AlignLeft | Qt.AlignBottom,
+                             f"{cell.length.total_seconds() / 3600:.1f}小时")
+        painter.end()
+
+    # 窗口看不见的时候不再刷新
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.dispatcher.set_active(self.subscription, True)
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.dispatcher.set_active(self.subscription, False)
+
+    def changeEvent(self, event):
+        super().changeEvent(event)
+        if event.type() == QEvent.WindowStateChange:
+            if self.isMinimized():
+                self.dispatcher.set_active(self.subscription, False)
+            elif self.isVisible():
+                self.dispatcher.set_active(self.subscription, True)
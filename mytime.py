@@ -5,20 +5,144 @@
 # @Brief   :
 from __future__ import annotations
 
+import asyncio
+import functools
+import itertools
+import re
+import shutil
 import sys
-from collections import defaultdict
+import threading
+import weakref
+import zlib
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque, OrderedDict
 from functools import total_ordering
 from datetime import datetime, timedelta, timezone, tzinfo
 import time
-import math
+from bisect import bisect_right
 from pathlib import WindowsPath, PosixPath, Path
 import json
-from typing import Callable
+import logging
+import os
+from collections.abc import Sequence
+from typing import Callable, Iterable, NamedTuple
 
 import path_def
+from activity import traced
+from clock import Clock, REAL_CLOCK
+from cold_store import ColdStore
+from day_stats import DayLengthStats
+from file_lock import FileLock
+from zones import Zone, get_zone
+
+log = logging.getLogger(__name__)
 
 CHINA_TIMEZONE = timezone(timedelta(hours=8))
 UTC_TIMEZONE = timezone(timedelta())
+# 内部的时间一律是整数微秒，浮点数的秒只出现在接口的边缘
+US_PER_SEC = 1000000
+_EPOCH = datetime(1970, 1, 1, tzinfo=UTC_TIMEZONE)
+_ONE_US = timedelta(microseconds=1)
+
+
+def sec_to_us(t: float) -> int:
+    if isinstance(t, int):
+        return t * US_PER_SEC
+    return round(t * US_PER_SEC)
+
+
+def us_to_sec(t: int) -> float | int:
+    """整秒的返回int，存文件时保持原来的格式"""
+    sec, us = divmod(t, US_PER_SEC)
+    if us == 0:
+        return sec
+    return t / US_PER_SEC
+
+
+def datetime_to_us(dt: datetime) -> int:
+    return (dt - _EPOCH) // _ONE_US
+
+
+def is_aware(dt: datetime) -> bool:
+    """是不是带有时区的绝对时间。UTC这种偏移为0的也算"""
+    return dt.tzinfo is not None and dt.utcoffset() is not None
+
+
+class SaveFileError(ValueError):
+    """保存文件的内容不对"""
+
+
+def _parse_day_time_map(values, prev: int = None, strict=True) -> array:
+    """
+    保存文件中的day_time_map（秒）转换成微秒，同时检查严格递增，只过一遍。
+    strict为False时遇到不对的值就停下，返回前面的部分
+    """
+    out = array("q")
+    append = out.append
+    for t in values:
+        if type(t) is int:
+            t *= US_PER_SEC
+        elif type(t) is float:
+            t = round(t * US_PER_SEC)
+        elif strict:
+            raise SaveFileError("day_time_map中有不是数字的值", len(out), t)
+        else:
+            break
+        if prev is not None and t <= prev:
+            if strict:
+                raise SaveFileError("day_time_map不是严格递增的", len(out), t)
+            break
+        append(t)
+        prev = t
+    return out
+
+
+def _salvage_json(raw: bytes) -> dict:
+    """
+    从截断或者损坏的保存文件里尽量找出冷存储的索引和day_time_map前面完整的数字
+    """
+    text = raw.decode("utf-8", errors="replace")
+    data = {}
+    i = text.find('"cold"')
+    if i >= 0:
+        match = re.compile(r'"cold"\s*:\s*').match(text, i)
+        try:
+            data["cold"], _ = json.JSONDecoder().raw_decode(text, match.end())
+        except (AttributeError, ValueError):
+            # 有冷数据但是索引读不出来，后面的热数据就接不上了
+            data["cold"] = None
+            data["day_time_map"] = []
+            return data
+    i = text.find('"day_time_map"')
+    start = text.find("[", i) if i >= 0 else -1
+    if start < 0:
+        data["day_time_map"] = []
+        return data
+    end = text.find("]", start)
+    tokens = text[start + 1:end if end >= 0 else len(text)].split(",")
+    if end < 0:
+        # 最后一个数可能只写了一半
+        tokens.pop()
+    hot = []
+    for token in tokens:
+        try:
+            hot.append(json.loads(token))
+        except ValueError:
+            break
+    data["day_time_map"] = hot
+    return data
+
+
+class LoadReport(NamedTuple):
+    """最近一次读取保存文件的情况"""
+    # 数据来自哪个文件，没有可用的文件时是None
+    source: Path | None
+    count: int
+    # 保存文件本身的问题，没有问题是None
+    error: Exception | None = None
+    # 保存文件和备份都坏了，只取出了前面完好的部分
+    salvaged: bool = False
 
 
 #################################################
@@ -55,6 +179,146 @@ def _check_int_field(value):
                     type(value).__name__)
 
 
+class DayTimeList(list):
+    """
+    day_time_map在内存中的样子。记录自上次提交以来被改动过的最小下标，这样提交版本时只需要复制改动过的尾巴
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.low_water = len(self)
+
+    def reset_low_water(self):
+        self.low_water = len(self)
+
+    def _touch(self, index):
+        if index < 0:
+            index += len(self)
+        self.low_water = max(0, min(self.low_water, index))
+
+    def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            self._touch(key.indices(len(self))[0] if key.step is None or key.step > 0 else 0)
+        else:
+            self._touch(key)
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        if isinstance(key, slice):
+            self._touch(key.indices(len(self))[0] if key.step is None or key.step > 0 else 0)
+        else:
+            self._touch(key)
+        super().__delitem__(key)
+
+    def __iadd__(self, other):
+        self._touch(len(self))
+        return super().__iadd__(other)
+
+    def __imul__(self, other):
+        self._touch(len(self) if other >= 1 else 0)
+        return super().__imul__(other)
+
+    def append(self, value):
+        self._touch(len(self))
+        super().append(value)
+
+    def extend(self, values):
+        self._touch(len(self))
+        super().extend(values)
+
+    def insert(self, index, value):
+        self._touch(min(index, len(self)) if index >= 0 else index)
+        super().insert(index, value)
+
+    def pop(self, index=-1):
+        self._touch(index)
+        return super().pop(index)
+
+    def remove(self, value):
+        self._touch(self.index(value))
+        super().remove(value)
+
+    def clear(self):
+        self.low_water = 0
+        super().clear()
+
+    def sort(self, *args, **kwargs):
+        self.low_water = 0
+        super().sort(*args, **kwargs)
+
+    def reverse(self):
+        self.low_water = 0
+        super().reverse()
+
+
+class DayMapVersion(Sequence):
+    """
+    day_time_map的一个不可变版本。和上一个版本共享前prefix_len个元素，只保存自己不同的尾巴，
+    所以每个版本的代价是改动的条目数，而不是整个历史的长度。
+
+    按下标读的时候第一次沿着版本链把整个内容拼成一个平的列表，之后的读取都是O(1)。
+    只有最近用过的MAX_FLAT个版本留着平的列表，历史再长也只多占这么多份内存
+    """
+    MAX_FLAT = 8
+    # 留着平的列表的版本，旧的在前
+    _recent_flat: deque[DayMapVersion] = deque()
+
+    def __init__(self, parent: DayMapVersion | None, prefix_len: int, tail: tuple, number: int):
+        self.parent = parent
+        self.prefix_len = prefix_len
+        self.tail = tail
+        self.number = number
+        self._len = prefix_len + len(tail)
+        self._flat: list[int] | None = None
+
+    def __len__(self):
+        return self._len
+
+    def _materialize(self) -> list[int]:
+        flat = self._flat
+        if flat is not None:
+            return flat
+        # 从新往旧，每一段取覆盖它的最新的那个版本的尾巴，遇到已经拼好的版本就直接用它的前面部分
+        pieces = []
+        end = self._len
+        version = self
+        while end > 0:
+            if version._flat is not None:
+                pieces.append(version._flat[:end])
+                break
+            if version.prefix_len < end:
+                pieces.append(version.tail[:end - version.prefix_len])
+                end = version.prefix_len
+            version = version.parent
+        flat = self._flat = list(itertools.chain.from_iterable(reversed(pieces)))
+        recent = DayMapVersion._recent_flat
+        recent.append(self)
+        if len(recent) > self.MAX_FLAT:
+            recent.popleft()._flat = None
+        return flat
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._len)
+            if step == 1 and start >= self.prefix_len:
+                # 只读自己的尾巴，不用拼
+                return list(self.tail[start - self.prefix_len:stop - self.prefix_len])
+            return self._materialize()[index]
+        if index >= self.prefix_len:
+            return self.tail[index - self.prefix_len]
+        if index < 0:
+            index += self._len
+            if index < 0:
+                raise IndexError("DayMapVersion index out of range")
+        return self._materialize()[index]
+
+    def __iter__(self):
+        return iter(self._materialize())
+
+    def __repr__(self):
+        return f"<DayMapVersion #{self.number} len={self._len}>"
+
+
 class FileCacheLine:
     """
     表示一个文件的缓存
@@ -62,35 +326,106 @@ class FileCacheLine:
 
     def __init__(self, path=None):
         self.path: Path = path
-        self._file_data: None | list = None
+        self._file_data: None | DayTimeList = None
+        self._lock: None | FileLock = None
+        self._cold: None | ColdStore = None
+        # 自上次保存以来改动过的最小下标，落在冷数据里就要重写冷存储
+        self._dirty_from = 0
+        # 上次读写时保存文件的状态，没变就不用重新读
+        self._file_stamp = None
+        # 所有历史版本的尾巴加起来有多少条，用来估计内存
+        self._history_entries = 0
+        # 版本历史，_version_index之后的是可以重做的版本
+        self._versions: list[DayMapVersion] = []
+        self._version_index = -1
+        # edit_date嵌套的层数
+        self.edit_depth = 0
+        # 最外层的edit_date里的修改都做在这份副本上，提交时才换上去。
+        # 只有_stage_threads里的线程（做修改的）看到副本，别的线程看到的一直是上一次提交的数据
+        self._staged: DayTimeList | None = None
+        self._stage_threads: frozenset[int] = frozenset()
+        self._stage_version_index = -1
+        # 每次数据发生变化就加一，撤销也加一。依赖day_time_map的缓存用它判断是否过期
+        self.revision = 0
+        # 每个事件循环一把asyncio.Lock
+        self._async_locks = weakref.WeakKeyDictionary()
+        self.last_load: LoadReport | None = None
+        # 保存文件损坏时为True，下一次保存不把它挪去覆盖.bak
+        self._keep_backup = False
 
     def __bool__(self):
         return bool(self.path)
 
+    def async_lock(self) -> asyncio.Lock:
+        """当前事件循环中这个文件的asyncio锁，异步的修改依次进行"""
+        loop = asyncio.get_running_loop()
+        lock = self._async_locks.get(loop)
+        if lock is None:
+            lock = self._async_locks[loop] = asyncio.Lock()
+        return lock
+
     @property
     def file_data(self):
+        staged = self._staged
+        if staged is not None and threading.get_ident() in self._stage_threads:
+            return staged
         if self._file_data is not None:
+            if context_pool.mru is not self:
+                context_pool.touch(self)
             return self._file_data
         self.reload()
         return self._file_data
 
-    def _bin_search(self, t: float):
+    @property
+    def dirty(self) -> bool:
+        """内存里有没有还没写到文件里的修改"""
+        return self._file_data is not None and self._dirty_from < len(self._file_data)
+
+    def memory_estimate(self) -> int:
+        """内存中的数据大约占多少字节"""
+        if self._file_data is None:
+            return 0
+        return ENTRY_BYTES * (len(self._file_data) + self._history_entries)
+
+    @traced
+    def evict(self):
+        """
+        把数据从内存中丢掉，下次访问时重新从文件读取。正在修改中的不能丢，返回False。
+        撤销历史会一起丢掉
+        """
+        if self._file_data is None:
+            return True
+        if self.edit_depth or (self._lock is not None and self._lock.locked):
+            return False
+        if self and self.dirty:
+            # 还有没写出去的修改（比如上次保存失败了）。和edit_date一样在锁里先看文件有没有被别人改过：
+            # 改过就以磁盘上的为准，不能拿内存里旧的数据和冷存储的索引去覆盖别人的修改
+            with self.lock:
+                if not self.reload_if_changed():
+                    self.save()
+        self._file_data = None
+        self._versions = []
+        self._version_index = -1
+        self._history_entries = 0
+        self._file_stamp = None
+        self._cold = None
+        # 重新读取后版本号从0开始，按revision缓存的东西都要作废
+        self.revision += 1
+        return True
+
+    def _bin_search(self, t: int):
         day_time_list = self.file_data
         assert t >= day_time_list[0]
-        a = 0
-        b = len(day_time_list)
-        while b - a != 1:
-            mid = (a + b) // 2
-            if day_time_list[mid] <= t:
-                a = mid
-            else:
-                b = mid
-        assert 0 <= a < b < len(day_time_list)
+        a = bisect_right(day_time_list, t) - 1
+        assert 0 <= a < len(day_time_list) - 1
         return a, t - day_time_list[a]
 
     def get_last_time_last_day(self, zero_point_time: int):
         day_time_list = self.file_data
         if not day_time_list:
+            if not self.edit_depth or (self._staged is not None and day_time_list is not self._staged):
+                # 只是读，不要把纪元写进缓存，否则缓存就“脏”了，换出时会拿它去覆盖别人的文件
+                return zero_point_time, 0
             day_time_list.append(zero_point_time)
         last_time = day_time_list[-1]
         day = len(day_time_list) - 1
@@ -101,133 +436,768 @@ class FileCacheLine:
             return self.file_data[0]
         return zero_point_time
 
-    def get_day(self, t: float, default_day_sec: int, zero_point_time: int):
+    def get_day(self, t: int, default_day_us: int, zero_point_time: int):
+        """
+        全部以微秒为单位，返回(第几天, 这一天开始后过了多少微秒)
+        """
         day_time_list = self.file_data
         assert t >= self.get_zero_point(zero_point_time)
         if day_time_list and day_time_list[-1] > t:
             return self._bin_search(t)
 
         last_time, day = self.get_last_time_last_day(zero_point_time)
-        day += (int(t) - last_time) // default_day_sec  # python整除，浮点数作为操作数，则是浮点数
-        return round(day), (t - last_time) % default_day_sec
+        n, us = divmod(t - last_time, default_day_us)
+        return day + n, us
 
     calc_timestamp_until: Callable[[float], None]
 
-    def _calc_timestamp_until(self, t, default_day_sec: int, zero_point_time: int):
+    def _calc_timestamp_until(self, t: int, default_day_us: int, zero_point_time: int):
         day_time_list = self.file_data
         last_time, _ = self.get_last_time_last_day(zero_point_time)
-        while last_time + default_day_sec < t:
-            last_time += default_day_sec
+        while last_time + default_day_us < t:
+            last_time += default_day_us
             day_time_list.append(last_time)
 
-    def get_timestamp(self, total_day: int, sec: float, default_day_sec: int, zero_point_time: int):
+    def get_timestamp(self, total_day: int, us: int, default_day_us: int, zero_point_time: int):
         last_time, last_day = self.get_last_time_last_day(zero_point_time)
-        if total_day > last_day:
-            return (total_day - last_day) * default_day_sec + last_time + sec
-        return self.file_data[total_day] + sec
+        if total_day >= last_day:
+            return (total_day - last_day) * default_day_us + last_time + us
+        return self.file_data[total_day] + us
 
     @property
     def bak_file_path(self):
         bak_file_name = self.path.name + ".bak"
         return self.path.parent / bak_file_name
 
+    @property
+    def tmp_file_path(self):
+        return self.path.parent / (self.path.name + ".tmp")
+
+    @property
+    def cold_store(self) -> ColdStore:
+        if self._cold is None:
+            self._cold = ColdStore(self.path)
+        return self._cold
+
+    @property
+    def lock(self) -> FileLock:
+        """
+        跨进程的写锁，读-改-写的全过程都要持有它，否则并发的两个进程会互相覆盖
+        """
+        if self._lock is None:
+            self._lock = FileLock(self.path.parent / (self.path.name + ".lock"))
+        return self._lock
+
+    @traced
     def reload(self):
-        load_path = self.path
-        if not load_path.exists():
-            load_path = self.bak_file_path
-        if not load_path.exists():
-            self._file_data = []
-            return
+        self._set_loaded_data(self._load())
+
+    def _stat_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        # 每次保存都是replace上去的新文件，inode一定会变
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def reload_if_changed(self):
+        """
+        保存文件自上次读写之后没有变过就什么也不做，否则重新读取
+        """
+        # 文件还不存在时两边都是None，也算没有变，不要把内存里还没保存的数据冲掉
+        if self._file_data is not None and self._file_stamp == self._stat_stamp():
+            return False
+        self.reload()
+        return True
 
-        with load_path.open("rt", encoding="utf-8") as fp:
+    def _read_save(self, path: Path, strict=True) -> list[int]:
+        """
+        读取一个保存文件。解析、检查严格递增、转换成微秒、计算校验和，数据只过一遍。
+        strict为False时尽量取出前面完好的部分
+        """
+        raw = path.read_bytes()
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            if strict:
+                raise
+            data = _salvage_json(raw)
+            if "cold" not in data and any(self.path.parent.glob(self.path.name + ".cold.*")):
+                # 以前的格式把冷存储的索引写在最后，截断之后热数据前面缺了多少不知道
+                data["day_time_map"] = []
+        if not isinstance(data, dict) or not isinstance(data.get("day_time_map"), list):
+            raise SaveFileError("保存文件的格式不对", path)
+        # 较早的历史在冷存储里，是微秒；保存文件中的是最近的，单位是秒
+        index = data.get("cold")
+        cold = self.cold_store
+        values = cold.load(index, strict)
+        if index and len(cold.blocks) < len(index["blocks"]):
+            return values
+        hot = _parse_day_time_map(data["day_time_map"], values[-1] if values else None, strict)
+        if strict and "crc32" in data and zlib.crc32(hot) != data["crc32"]:
+            raise SaveFileError("校验和不对", path)
+        values.extend(hot)
+        return values
+
+    def _load(self):
+        """
+        依次尝试保存文件和.bak；都坏了就取两者中前面完好的部分里较长的那个。
+        保存文件损坏时另存一份.corrupt，并且下一次保存不拿它覆盖.bak
+        """
+        self._file_stamp = self._stat_stamp()
+        error = None
+        for path in (self.path, self.bak_file_path):
+            if not path.exists():
+                continue
             try:
-                self._file_data = json.load(fp)["day_time_map"]
+                data = self._read_save(path)
             except Exception as e:
-                print(e)
-                self._file_data = []
-                return
+                log.error("读取%s失败: %r", path, e)
+                error = error or e
+                continue
+            if error is not None:
+                log.warning("%s已损坏，使用%s", self.path, path)
+                self._keep_corrupt_copy()
+            self.last_load = LoadReport(path, len(data), error)
+            return data
+        if error is None:
+            # 还没有保存过
+            self.last_load = LoadReport(None, 0)
+            return []
+
+        best, best_path = [], None
+        for path in (self.path, self.bak_file_path):
+            try:
+                data = self._read_save(path, strict=False)
+            except Exception:
+                continue
+            if len(data) > len(best):
+                best, best_path = data, path
+        log.error("%s和备份都已损坏，从%s中恢复了前面完好的%d个分界点", self.path, best_path, len(best))
+        self._keep_corrupt_copy()
+        # 冷文件可能也坏了，下次保存时全部重新封存
+        self.cold_store.restart()
+        self.last_load = LoadReport(best_path, len(best), error, salvaged=True)
+        return best
+
+    def _keep_corrupt_copy(self):
+        self._keep_backup = True
+        if self.path.exists():
+            corrupt = self.path.parent / (self.path.name + ".corrupt")
+            shutil.copyfile(self.path, corrupt)
+            log.warning("损坏的保存文件另存为%s", corrupt)
+
+    def _set_loaded_data(self, data: list):
+        self._dirty_from = len(data)
+        if not self._versions:
+            self._file_data = DayTimeList(data)
+            self._versions.append(DayMapVersion(None, 0, tuple(data), 0))
+            self._version_index = 0
+            self._history_entries = len(data)
+            if self:
+                context_pool.loaded(self)
+            return
+        # 不在修改中时，内存里的_file_data就是当前版本的内容。直接和它比，
+        # DayMapVersion按下标取要沿着版本链往回找，历史长了会很慢
+        old = self._file_data
+        if old == data:
+            # 文件没有被别人改过，保留内存里的对象和历史
+            old.reset_low_water()
+            return
+        # 别的进程改过文件，把差异记成一个新版本
+        log.info("%s被其他进程修改过", self.path)
+        prefix_len = min(len(old), len(data))
+        if old[:prefix_len] != data[:prefix_len]:
+            for prefix_len, (a, b) in enumerate(zip(old, data)):
+                if a != b:
+                    break
+        self._file_data = DayTimeList(data)
+        self._file_data.low_water = prefix_len
+        self.commit_version()
+        # 这些修改本来就在磁盘上
+        self._dirty_from = len(data)
 
+    @property
+    def version(self) -> int:
+        self.file_data  # noqa 确保已经加载
+        return self._version_index
+
+    def get_version(self, number: int) -> DayMapVersion:
+        self.file_data  # noqa 确保已经加载
+        if not 0 <= number < len(self._versions):
+            raise ValueError("没有这个版本", number)
+        return self._versions[number]
+
+    def commit_version(self):
+        """
+        把自上次提交以来对file_data的修改记为一个新的版本，没有修改则什么也不做。返回当前版本号
+        """
+        data = self.file_data
+        current = self._versions[self._version_index]
+        low = min(data.low_water, len(current))
+        tail = tuple(data[low:])
+        data.reset_low_water()
+        if len(data) == len(current) and tuple(current[low:]) == tail:
+            return self._version_index
+        del self._versions[self._version_index + 1:]
+        self._versions.append(DayMapVersion(current, low, tail, len(self._versions)))
+        self._history_entries += len(tail)
+        self._dirty_from = min(self._dirty_from, low)
+        self._version_index += 1
+        self.revision += 1
+        return self._version_index
+
+    def begin_edit(self, threads: Iterable[int]):
+        """
+        最外层的edit_date开始时调用：复制一份当前的数据，之后threads中的线程读写的都是这份副本
+        """
+        self._staged = DayTimeList(self.file_data)
+        self._stage_version_index = self._version_index
+        self._stage_threads = frozenset(threads)
+
+    def end_edit(self):
+        """
+        提交之后调用：把副本换上去，别的线程从此看到新的数据
+        """
+        staged = self._staged
+        if staged is None:
+            return
+        self._file_data = staged
+        self._staged = None
+        self._stage_threads = frozenset()
+        # 修改期间别的线程可能按新的revision缓存了旧的数据
+        self.revision += 1
+
+    def rollback(self):
+        """
+        丢弃自上次提交以来对file_data的修改
+        """
+        if self._staged is not None:
+            # 副本直接丢掉，事务里撤销、重做过的话版本也回到开始的时候
+            self._staged = None
+            self._stage_threads = frozenset()
+            self._version_index = self._stage_version_index
+            self.revision += 1
+            return
+        data = self.file_data
+        current = self._versions[self._version_index]
+        self._checkout(min(data.low_water, len(current)), current)
+
+    def check_tail(self):
+        """
+        检查自上次提交以来改过的部分是否严格递增，不合法则抛出ValueError
+        """
+        data = self.file_data
+        for i in range(max(1, data.low_water), len(data)):
+            if not data[i - 1] < data[i]:
+                raise ValueError("day_time_map必须严格递增", i, data[i - 1], data[i])
+
+    def _checkout(self, prefix_len: int, target: DayMapVersion):
+        data = self.file_data
+        del data[prefix_len:]
+        data.extend(target[prefix_len:])
+        self._dirty_from = min(self._dirty_from, prefix_len)
+        data.reset_low_water()
+        self.revision += 1
+
+    def can_undo(self):
+        return self.version > 0
+
+    def can_redo(self):
+        return self.version < len(self._versions) - 1
+
+    def undo(self):
+        if not self.can_undo():
+            return False
+        current = self._versions[self._version_index]
+        self._version_index -= 1
+        self._checkout(current.prefix_len, self._versions[self._version_index])
+        return True
+
+    def redo(self):
+        if not self.can_redo():
+            return False
+        self._version_index += 1
+        target = self._versions[self._version_index]
+        self._checkout(target.prefix_len, target)
+        return True
+
+    @traced
     def save(self):
         if not self or self._file_data is None:
             # 没有更改
             return False
 
         assert self
-        # 确保路径存在
-        if not self.path.parent.exists():
-            self.path.parent.mkdir(parents=True)
-        # 备份
-        if self.path.exists():
-            if self.bak_file_path.exists():
-                self.bak_file_path.unlink()
-            self.path.rename(self.bak_file_path)
-        data = {"day_time_map": self._file_data}
-        with self.path.open("wt", encoding="utf-8") as fp:
-            json.dump(data, fp)
+        start = time.perf_counter()
+        with self.lock:
+            # 确保路径存在
+            if not self.path.parent.exists():
+                self.path.parent.mkdir(parents=True)
+            # 旧的部分封存到只追加的冷存储，保存文件里只写最近的热数据
+            cold = self.cold_store
+            cold.seal(self._file_data, self._dirty_from)
+            # 冷存储的索引写在前面，文件被截断时还能找到
+            data = {}
+            if cold.index():
+                data["cold"] = cold.index()
+            hot = array("q", self._file_data[cold.count:])
+            data["day_time_map"] = [us_to_sec(t) for t in hot]
+            data["crc32"] = zlib.crc32(hot)
+            # 先完整写到临时文件，再用原子的replace换上去，任何时刻都至少有一个完整的文件
+            with self.tmp_file_path.open("wt", encoding="utf-8") as fp:
+                json.dump(data, fp)
+                fp.flush()
+                os.fsync(fp.fileno())
+            # 备份。读取时发现保存文件损坏的话，.bak才是好的，不要覆盖它
+            if self.path.exists() and not self._keep_backup:
+                os.replace(self.path, self.bak_file_path)
+            os.replace(self.tmp_file_path, self.path)
+            self._keep_backup = False
+            self._dirty_from = len(self._file_data)
+            self._file_stamp = self._stat_stamp()
+        log.debug("保存%s，热数据%d条，冷数据%d条，用时%.1fms", self.path, len(data["day_time_map"]), cold.count,
+                  (time.perf_counter() - start) * 1000)
         return True
 
 
+# 估计内存用：一个int对象加上列表里的一个指针
+ENTRY_BYTES = 40
+
+
+class ContextPool:
+    """
+    已经加载到内存的保存文件，按最近使用排序。超过数量或者内存预算时，
+    把最久没用、也没有在修改中的那些写回并从内存中丢掉，下次用到时再从文件读取
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_loaded: int = 32):
+        self.max_bytes = max_bytes
+        self.max_loaded = max_loaded
+        self._lru: OrderedDict[FileCacheLine, None] = OrderedDict()
+        self.mru: FileCacheLine | None = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, max_bytes: int = None, max_loaded: int = None):
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        if max_loaded is not None:
+            self.max_loaded = max_loaded
+        self.enforce()
+
+    def touch(self, file_cache: FileCacheLine):
+        if not file_cache:
+            return
+        self._lru[file_cache] = None
+        self._lru.move_to_end(file_cache)
+        self.mru = file_cache
+
+    def record_access(self, file_cache: FileCacheLine):
+        if file_cache._file_data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+    def loaded(self, file_cache: FileCacheLine):
+        self.touch(file_cache)
+        self.enforce()
+
+    def memory_estimate(self) -> int:
+        return sum(file_cache.memory_estimate() for file_cache in self._lru)
+
+    @traced
+    def enforce(self):
+        total = self.memory_estimate()
+        for file_cache in list(self._lru):
+            if len(self._lru) <= self.max_loaded and total <= self.max_bytes:
+                break
+            if file_cache is self.mru:
+                continue
+            size = file_cache.memory_estimate()
+            if not file_cache.evict():
+                continue
+            del self._lru[file_cache]
+            entry = DatetimeContext.path_map.get(file_cache.path)
+            if entry is not None:
+                for context in entry["context_list"]:
+                    context._day_stats.clear()
+                # 历法都没了、当时因为没保存而留下的缓存，现在写回了，可以放掉
+                DatetimeContext._release_path(file_cache.path)
+            total -= size
+            self.evictions += 1
+
+    def forget(self, file_cache: FileCacheLine):
+        """不再管理file_cache，已经没有历法在用它了"""
+        self._lru.pop(file_cache, None)
+        if self.mru is file_cache:
+            self.mru = None
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "loaded": len(self._lru),
+            "memory_estimate": self.memory_estimate(),
+            "max_bytes": self.max_bytes,
+            "max_loaded": self.max_loaded,
+        }
+
+
+context_pool = ContextPool()
+
+
+class RangeStats(NamedTuple):
+    """
+    连续若干天的统计，[start_us, end_us)
+    """
+    start_us: int
+    end_us: int
+    count: int
+
+    @property
+    def duration_us(self) -> int:
+        return self.end_us - self.start_us
+
+    @property
+    def duration(self) -> timedelta:
+        return timedelta(microseconds=self.duration_us)
+
+    @property
+    def mean_us(self) -> float | None:
+        if not self.count:
+            return None
+        return self.duration_us / self.count
+
+
 class DatetimeContext:
     """
     表示一个历法规则
     """
-    all_instance = {}
-    path_map = defaultdict(lambda: {"context_list": [], "file_cache": FileCacheLine()})
+    # 都是弱引用，没有人用的历法会被回收；已加载的数据由context_pool管理
+    all_instance = weakref.WeakValueDictionary()
+    # 保存文件 -> {"context_list": 用这个文件的历法, "file_cache": 共用的缓存}。
+    # 最后一个历法被回收、缓存里也没有没保存的修改时，整项删掉，见_release_path
+    path_map: dict[Path, dict] = {}
+    pool = context_pool
 
     def __new__(cls, zero_point: int, hour_per_day: float, day_per_cycle: int, cycle_per_stage, save_path: Path):
+        save_path = save_path.resolve()
+        key = zero_point, hour_per_day, day_per_cycle, cycle_per_stage, save_path
+        self = cls.all_instance.get(key)
+        if self is not None:
+            return self
         self = object.__new__(cls)
-        self._save_path = save_path.resolve()
+        self._save_path = save_path
         self._cycle_per_stage = cycle_per_stage
         self._day_per_cycle = day_per_cycle
         self._hour_per_day = hour_per_day
         self._zero_point = zero_point
-        if self in cls.all_instance:
-            return cls.all_instance[self]
-
-        self._bind_dt = {}
-        cls.all_instance[self] = self
-        cls.path_map[self._save_path]["context_list"].append(self)
-        if not cls.path_map[self._save_path]["file_cache"]:
-            cls.path_map[self._save_path]["file_cache"].path = self._save_path
-        self._file_cache = cls.path_map[self._save_path]["file_cache"]
+
+        # 弱引用，不再使用的MyDateTime会被回收，不会在每次修改时被重新计算
+        self._bind_dt = weakref.WeakValueDictionary()
+        # 异步接口在io线程里重新计算绑定的MyDateTime，别的线程同时在创建、绑定新的
+        self._bind_lock = threading.RLock()
+        # 窗口长度 -> 统计，自适应天长用的和别人要的互不干扰
+        self._day_stats: dict[int, DayLengthStats] = {}
+        self._adaptive_method = None
+        self._adaptive_window = 28
+        self._clock: Clock = REAL_CLOCK
+        cls.all_instance[key] = self
+        entry = cls.path_map.get(save_path)
+        if entry is None:
+            entry = cls.path_map[save_path] = {"context_list": weakref.WeakSet(), "file_cache": FileCacheLine(save_path)}
+        entry["context_list"].add(self)
+        self._file_cache = entry["file_cache"]
+        weakref.finalize(self, DatetimeContext._release_path, save_path)
         return self
 
+    @classmethod
+    def _release_path(cls, save_path: Path):
+        """
+        save_path上已经没有历法了，把它的缓存也放掉。还有没保存的修改（比如保存失败了）就先留着，
+        等context_pool换出时写回
+        """
+        entry = cls.path_map.get(save_path)
+        if entry is None:
+            return
+        # WeakSet的迭代只给出还活着的，刚被回收的那个可能还没从里面删掉
+        if next(iter(entry["context_list"]), None) is not None:
+            return
+        file_cache = entry["file_cache"]
+        if file_cache.edit_depth or file_cache.dirty:
+            return
+        del cls.path_map[save_path]
+        context_pool.forget(file_cache)
+
+    def _init_fields(self, base: DatetimeContext):
+        """
+        历史版本、草稿这些建在base上的历法用：规则、时钟、自适应天长的设置和base一样，
+        绑定的MyDateTime和统计是自己的。不登记到all_instance和path_map里，_file_cache由子类设置
+        """
+        self._save_path = base.save_path
+        self._cycle_per_stage = base.cycle_per_stage
+        self._day_per_cycle = base.day_per_cycle
+        self._hour_per_day = base.hour_per_day
+        self._zero_point = base.zero_point
+        self._bind_dt = weakref.WeakValueDictionary()
+        self._bind_lock = threading.RLock()
+        self._day_stats: dict[int, DayLengthStats] = {}
+        self._adaptive_method = base._adaptive_method
+        self._adaptive_window = base._adaptive_window
+        self._clock = base.clock
+
     def bind(self, dt):
-        self._bind_dt[id(dt)] = dt
+        with self._bind_lock:
+            self._bind_dt[id(dt)] = dt
 
     def unbind(self, dt):
-        del self._bind_dt[id(dt)]
+        with self._bind_lock:
+            self._bind_dt.pop(id(dt), None)
 
+    @traced
     def on_change(self, save=True):
         if save:
             self._file_cache.save()
-        for context in self.path_map[self.save_path]["context_list"]:
+        for context in list(self.path_map[self.save_path]["context_list"]):
             assert isinstance(context, DatetimeContext)
-            for obj in context._bind_dt.values():
+            context._recalc_bound()
+
+    def _recalc_bound(self):
+        # 可能在io线程里调用。持有_bind_lock，别的线程上正在创建的MyDateTime要等这里算完才绑定
+        with self._bind_lock:
+            for obj in list(self._bind_dt.values()):
                 obj.re_calc_datetime()
 
     class EditDate:
+        """
+        在文件锁之内完成读-改-写。进入时重新读取磁盘上的数据，修改作用在最新的数据上，退出时保存再释放锁。
+
+        可以嵌套，也就是一个事务：只有最外层退出时才校验、提交版本、保存、通知一次；
+        有异常或校验失败时，整个事务中的修改都会回滚。
+        修改做在一份副本上，提交时才换上去，别的线程不会看到做了一半的修改
+        """
+
         def __init__(self, context: DatetimeContext):
             self.context = context
+            self._old_helper = None
+            # 异步接口中async with里的修改在事件循环的线程里做，它也要看到副本
+            self.loop_thread: int | None = None
 
         def __enter__(self):
+            file_cache = self.context._file_cache
+
             def helper_func(t=...):
+                """t是微秒"""
                 if t is ...:
-                    t = time.time()
-                self.context._file_cache._calc_timestamp_until(t, int(self.context.hour_per_day * 3600),
-                                                               self.context.zero_point)
+                    t = self.context.clock.now_us()
+                file_cache._calc_timestamp_until(t, self.context.default_day_us, self.context.zero_point_us)
 
-            self.context._file_cache.calc_timestamp_until = helper_func
-            return self.context._file_cache
+            if file_cache:
+                file_cache.lock.acquire()
+            try:
+                if file_cache.edit_depth == 0:
+                    context_pool.record_access(file_cache)
+                    # 别的进程可能在我们缓存之后改过文件
+                    file_cache.reload_if_changed()
+                    threads = {threading.get_ident()}
+                    if self.loop_thread is not None:
+                        threads.add(self.loop_thread)
+                    file_cache.begin_edit(threads)
+            except BaseException:
+                if file_cache:
+                    file_cache.lock.release()
+                raise
+            file_cache.edit_depth += 1
+            self._old_helper = file_cache.__dict__.get("calc_timestamp_until")
+            file_cache.calc_timestamp_until = helper_func
+            return file_cache
 
         def __exit__(self, exc_type, exc_val, exc_tb):
-            self.context.on_change()
+            file_cache = self.context._file_cache
+            if self._old_helper is None:
+                # 最外层，不要留下一个None
+                del file_cache.calc_timestamp_until
+            else:
+                file_cache.calc_timestamp_until = self._old_helper
+            file_cache.edit_depth -= 1
+            try:
+                if file_cache.edit_depth > 0:
+                    return
+                if exc_type is not None:
+                    log.warning("修改%s时出错，已回滚: %r", file_cache.path, exc_val)
+                    file_cache.rollback()
+                    return
+                try:
+                    file_cache.check_tail()
+                except ValueError as e:
+                    log.warning("修改%s不合法，已回滚: %r", file_cache.path, e)
+                    file_cache.rollback()
+                    raise
+                version = file_cache.commit_version()
+                file_cache.end_edit()
+                file_cache.save()
+                log.debug("修改%s，版本%d，尾部%r", file_cache.path, version, file_cache.file_data[-3:])
+            finally:
+                if file_cache:
+                    file_cache.lock.release()
+            self.context.on_change(save=False)
+            context_pool.enforce()
 
     def edit_date(self):
         return self.EditDate(self)
 
+    # 异步接口的文件读写都在这个线程里做。FileLock按线程重入，加锁和解锁必须在同一个线程
+    io_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mytime-io")
+
+    def _submit_io(self, func, *args, **kwargs) -> asyncio.Future:
+        return asyncio.get_running_loop().run_in_executor(
+            self.io_executor, functools.partial(func, *args, **kwargs))
+
+    async def arun(self, func, *args, **kwargs):
+        """
+        在io线程中执行func(*args, **kwargs)，同一个保存文件上的调用依次进行，不阻塞事件循环
+        """
+        async with self._file_cache.async_lock():
+            return await asyncio.shield(self._submit_io(func, *args, **kwargs))
+
+    async def aload(self):
+        """在后台读取保存文件，已经读过并且文件没有变就什么也不做"""
+        if self._file_cache:
+            await self.arun(self._file_cache.reload_if_changed)
+        return self
+
+    class AsyncEditDate:
+        """
+        edit_date的异步版本。加锁、读取和保存在io线程里做，async with里面的修改在事件循环中做，只改内存。
+
+            async with context.aedit_date() as data_cache:
+                data_cache.file_data.append(...)
+
+        里面不能再调用同步的edit_date或者command中的命令，那样会等待io线程持有的文件锁
+        """
+
+        def __init__(self, context: DatetimeContext):
+            self.context = context
+            self._edit = context.EditDate(context)
+            self._lock: asyncio.Lock | None = None
+
+        async def __aenter__(self):
+            lock = self.context._file_cache.async_lock()
+            await lock.acquire()
+            self._lock = lock
+            self._edit.loop_thread = threading.get_ident()
+            future = self.context._submit_io(self._edit.__enter__)
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # __enter__还在io线程里跑，等它结束后回滚再放锁
+                future.add_done_callback(self._abort)
+                raise
+            except BaseException:
+                lock.release()
+                raise
+
+        def _abort(self, future: asyncio.Future):
+            if future.cancelled() or future.exception() is not None:
+                self._lock.release()
+                return
+            error = asyncio.CancelledError()
+            self.context._submit_io(self._edit.__exit__, type(error), error, None) \
+                .add_done_callback(lambda _: self._lock.release())
+
+        async def __aexit__(self, exc_type, exc_val, exc_tb):
+            future = self.context._submit_io(self._edit.__exit__, exc_type, exc_val, exc_tb)
+            # 被取消了也要等保存结束才放锁
+            future.add_done_callback(lambda _: self._lock.release())
+            return await asyncio.shield(future)
+
+    def aedit_date(self):
+        return self.AsyncEditDate(self)
+
+    def transaction(self):
+        """
+        批量修改。里面可以调用任意多个command中的命令或者直接改尾巴，最后只保存一次、通知一次
+
+            with context.transaction() as data_cache:
+                command.good_night()
+                data_cache.file_data.append(...)
+        """
+        return self.EditDate(self)
+
+    @property
+    def version(self) -> int:
+        """
+        当前day_time_map的版本号，每次修改都会加一，撤销会减一
+        """
+        return self._file_cache.version
+
+    def overlay(self) -> OverlayContext:
+        """
+        在这个历法上开一层草稿，用来预览修改的结果，见OverlayContext
+        """
+        return OverlayContext(self)
+
+    def as_of(self, version: int) -> DatetimeContextSnapshot:
+        """
+        返回某个历史版本的只读历法，可以传给MyDateTime.from_timestamp等，问“那时候的钟显示的是几点”
+        """
+        return DatetimeContextSnapshot(self, self._file_cache.get_version(version))
+
     def get_total_day(self, t: float):
-        return self._file_cache.get_day(t, int(self.hour_per_day * 3600), self.zero_point)
+        total_day, us = self.get_total_day_us(sec_to_us(t))
+        return total_day, us / US_PER_SEC
+
+    def get_total_day_us(self, t: int):
+        context_pool.record_access(self._file_cache)
+        return self._file_cache.get_day(t, self.default_day_us, self.zero_point_us)
+
+    def get_timestamp_us(self, total_day: int, us: int):
+        """第total_day天开始后us微秒的时间戳（微秒）"""
+        context_pool.record_access(self._file_cache)
+        return self._file_cache.get_timestamp(total_day, us, self.default_day_us, self.zero_point_us)
+
+    def day_start_us(self, total_day: int) -> int:
+        """第total_day天（从0开始）开始的时间戳，微秒。超出记录的部分按外推计算"""
+        if total_day < 0:
+            raise ValueError("纪元前时间无定义", total_day)
+        return self.get_timestamp_us(total_day, 0)
+
+    def day_starts_us(self, start: int, stop: int) -> list[int]:
+        """
+        第start天到第stop天（含）每天开始的时间戳，微秒。记录中有的部分一次切片取出，超出的部分外推
+        """
+        if not 0 <= start <= stop:
+            raise ValueError("需要 0 <= start <= stop", start, stop)
+        file_cache = self._file_cache
+        context_pool.record_access(file_cache)
+        last_time, last_day = file_cache.get_last_time_last_day(self.zero_point_us)
+        starts = list(file_cache.file_data[start:min(stop, last_day) + 1])
+        default_day_us = self.default_day_us
+        # 还没有记录时连第0天也是外推的
+        for day in range(start + len(starts), stop + 1):
+            starts.append(last_time + (day - last_day) * default_day_us)
+        return starts
+
+    # day_time_map本身就是每天长度的前缀和，任意一段连续的天的总长就是两个分界点之差，
+    # 所以下面的查询都是常数时间，不需要单独维护索引
+
+    def days_stats(self, start: int, stop: int) -> RangeStats:
+        """第start天到第stop天（不含），下标从0开始"""
+        if not 0 <= start <= stop:
+            raise ValueError("需要 0 <= start <= stop", start, stop)
+        return RangeStats(self.day_start_us(start), self.day_start_us(stop), stop - start)
+
+    def cycles_stats(self, start: int, stop: int) -> RangeStats:
+        """第start周到第stop周（不含），从纪元开始计数，下标从0开始"""
+        return self.days_stats(start * self.day_per_cycle, stop * self.day_per_cycle)
+
+    def stages_stats(self, start: int, stop: int) -> RangeStats:
+        """第start月到第stop月（不含），下标从0开始，也就是MyDateTime.stage - 1"""
+        day_per_stage = self.day_per_cycle * self.cycle_per_stage
+        return self.days_stats(start * day_per_stage, stop * day_per_stage)
 
     def get_tuple(self):
         return self._zero_point, self._hour_per_day, self._day_per_cycle, self._cycle_per_stage, self._save_path
@@ -238,6 +1208,16 @@ class DatetimeContext:
     def __hash__(self):
         return hash(self.get_tuple())
 
+    @property
+    def clock(self) -> Clock:
+        """物理时间的来源，默认是系统时间"""
+        return self._clock
+
+    @clock.setter
+    def clock(self, clock: Clock):
+        self._clock = clock
+        self.on_change(save=False)
+
     @property
     def save_path(self):
         return self._save_path
@@ -246,10 +1226,45 @@ class DatetimeContext:
     def zero_point(self):
         return self._zero_point
 
+    @property
+    def zero_point_us(self):
+        return self._zero_point * US_PER_SEC
+
     @property
     def hour_per_day(self):
         return self._hour_per_day
 
+    @property
+    def default_day_us(self):
+        """往后外推时每天的长度，微秒。开启了自适应天长时，用统计出来的预测值"""
+        if self._adaptive_method is not None:
+            predicted = self.day_length_stats(self._adaptive_window).predict(self._adaptive_method)
+            if predicted is not None:
+                return int(predicted)
+        return int(self._hour_per_day * 3600) * US_PER_SEC
+
+    def day_length_stats(self, window: int = 28) -> DayLengthStats:
+        """
+        最近window天实际长度的统计，随day_time_map增量更新。每种window各保留一份
+        """
+        stats = self._day_stats.get(window)
+        if stats is None:
+            stats = self._day_stats[window] = DayLengthStats(window)
+        file_cache = self._file_cache
+        stats.sync(file_cache.file_data, file_cache.revision)
+        return stats
+
+    def set_adaptive_day_length(self, method: str | None = "median", window: int = 28):
+        """
+        往后外推时，用最近window天统计出来的天长代替固定的hour_per_day。
+        method可以是median、mean、trend，None表示关闭
+        """
+        self._adaptive_method = method
+        self._adaptive_window = window
+        if method is not None:
+            self.day_length_stats(window).predict(method)
+        self.on_change(save=False)
+
     @property
     def day_per_cycle(self):
         return self._day_per_cycle
@@ -259,6 +1274,325 @@ class DatetimeContext:
         return self._cycle_per_stage
 
 
+class FrozenCacheLine(FileCacheLine):
+    """
+    只读的缓存，数据来自一个DayMapVersion，不对应任何文件
+    """
+
+    def __init__(self, day_map: DayMapVersion):
+        super().__init__()
+        self._file_data = day_map
+
+    def reload(self):
+        pass
+
+    def save(self):
+        return False
+
+
+class DatetimeContextSnapshot(DatetimeContext):
+    """
+    某个历史版本上的历法，只读
+    """
+
+    def __new__(cls, base: DatetimeContext, day_map: DayMapVersion):
+        self = object.__new__(cls)
+        self._init_fields(base)
+        self._file_cache = FrozenCacheLine(day_map)
+        self._day_map = day_map
+        return self
+
+    def bind(self, dt):
+        # 历史版本不会再变，不需要重新计算
+        pass
+
+    def unbind(self, dt):
+        pass
+
+    def on_change(self, save=True):
+        pass
+
+    def edit_date(self):
+        raise TypeError("历史版本是只读的")
+
+    def aedit_date(self):
+        raise TypeError("历史版本是只读的")
+
+    @property
+    def version(self) -> int:
+        return self._day_map.number
+
+    def get_tuple(self):
+        return super().get_tuple() + (self._day_map.number,)
+
+
+class OverlayConflictError(ValueError):
+    """草稿打开之后，底下的day_time_map被别人改过"""
+
+
+class OverlayDayList:
+    """
+    底下的day_time_map的前prefix_len个加上自己的tail，用起来和DayTimeList一样。
+    只有改到底下那部分时，才把被改的那一段复制到tail里，底下的数据不会被改，也不会整个复制
+    """
+
+    def __init__(self, base: FileCacheLine):
+        self._base = base
+        self.prefix_len = len(base.file_data)
+        self.tail = []
+        self.low_water = self.prefix_len
+
+    def _prefix(self, base_data):
+        # 底下被撤销变短了的话，草稿也跟着变短
+        return min(self.prefix_len, len(base_data))
+
+    def __len__(self):
+        return self._prefix(self._base.file_data) + len(self.tail)
+
+    def __getitem__(self, index):
+        base_data = self._base.file_data
+        prefix = self._prefix(base_data)
+        if isinstance(index, slice):
+            start, stop, step = index.indices(prefix + len(self.tail))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return list(base_data[start:min(stop, prefix)]) + \
+                self.tail[max(start - prefix, 0):max(stop - prefix, 0)]
+        if index < 0:
+            index += prefix + len(self.tail)
+            if index < 0:
+                raise IndexError("OverlayDayList index out of range")
+        if index < prefix:
+            return base_data[index]
+        return self.tail[index - prefix]
+
+    def __iter__(self):
+        base_data = self._base.file_data
+        yield from itertools.islice(base_data, self._prefix(base_data))
+        yield from self.tail
+
+    def __repr__(self):
+        return f"<OverlayDayList prefix={self.prefix_len} tail={self.tail!r}>"
+
+    def _own(self, index: int):
+        """让index及之后的元素都在tail里"""
+        base_data = self._base.file_data
+        prefix = self._prefix(base_data)
+        if index < prefix:
+            self.tail[:0] = base_data[index:prefix]
+            prefix = index
+        self.prefix_len = prefix
+        self.low_water = max(0, min(self.low_water, index))
+
+    def _index(self, index: int) -> int:
+        n = len(self)
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError("OverlayDayList index out of range")
+        self._own(index)
+        return index - self.prefix_len
+
+    def _slice(self, index: slice) -> slice:
+        start, stop, step = index.indices(len(self))
+        if step != 1:
+            raise ValueError("只支持步长为1的切片")
+        self._own(start)
+        return slice(start - self.prefix_len, max(start, stop) - self.prefix_len)
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            self.tail[self._slice(index)] = value
+        else:
+            self.tail[self._index(index)] = value
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            del self.tail[self._slice(index)]
+        else:
+            del self.tail[self._index(index)]
+
+    def append(self, value):
+        self._own(len(self))
+        self.tail.append(value)
+
+    def extend(self, values):
+        self._own(len(self))
+        self.tail.extend(values)
+
+    def pop(self, index=-1):
+        return self.tail.pop(self._index(index))
+
+    def reset_low_water(self):
+        self.low_water = len(self)
+
+
+class OverlayCacheLine(FileCacheLine):
+    """
+    草稿的缓存，不对应任何文件，也没有撤销历史。edit_date提交时只记下当前的草稿，失败时回到上一次提交的草稿
+    """
+
+    def __init__(self, base: FileCacheLine):
+        super().__init__()
+        self.base = base
+        self.remember_base()
+        self._file_data = OverlayDayList(base)
+        self._committed = (self._file_data.prefix_len, ())
+
+    @property
+    def file_data(self):
+        # 不进context_pool，草稿的内存跟着底下的缓存走
+        return self._file_data
+
+    @property
+    def revision(self):
+        # 底下变了草稿上算出来的东西也要作废
+        return self.base.revision, self._revision
+
+    @revision.setter
+    def revision(self, value):
+        self._revision = value
+
+    def reload(self):
+        pass
+
+    def reload_if_changed(self):
+        return False
+
+    def save(self):
+        return False
+
+    def evict(self):
+        return False
+
+    def begin_edit(self, threads):
+        # 草稿本来就是副本
+        pass
+
+    def end_edit(self):
+        pass
+
+    def commit_version(self):
+        data = self._file_data
+        data.reset_low_water()
+        if (data.prefix_len, tuple(data.tail)) != self._committed:
+            self._committed = (data.prefix_len, tuple(data.tail))
+            self._revision += 1
+        return 0
+
+    def rollback(self):
+        data = self._file_data
+        data.prefix_len, tail = self._committed
+        data.tail = list(tail)
+        data.reset_low_water()
+        self._revision += 1
+
+    def remember_base(self):
+        """记下底下现在的内容，commit时用来判断底下有没有被改过"""
+        base = self.base
+        self.base_revision = base.revision
+        # 底下可能是快照或者另一层草稿，没有版本可记，直接复制一份，只有天数那么长
+        self.base_data = tuple(base.file_data)
+
+    def base_changed(self, base_data) -> bool:
+        """
+        底下的内容和记下的是否不一样。evict之后重新加载、撤销再重做都会让revision变，
+        但内容没变就不算被改过
+        """
+        if self.base.revision == self.base_revision:
+            return False
+        return tuple(base_data) != self.base_data
+
+    def reset(self):
+        """丢掉草稿，回到底下现在的样子"""
+        self.remember_base()
+        self._file_data = OverlayDayList(self.base)
+        self._committed = (self._file_data.prefix_len, ())
+        self._revision += 1
+
+    def can_undo(self):
+        return False
+
+    def can_redo(self):
+        return False
+
+    def undo(self):
+        return False
+
+    def redo(self):
+        return False
+
+
+class OverlayContext(DatetimeContext):
+    """
+    一个DatetimeContext上的草稿。command中的命令、edit_date都可以用在它上面，修改只记在内存里，
+    不复制底下的day_time_map，不写文件，不通知底下的MyDateTime；MyDateTime可以直接用它换算，看修改之后的结果。
+
+        with context.overlay() as draft:
+            command.set_today_hours(20, context=draft)
+            print(MyDateTime.now(draft))
+            draft.commit()
+
+    commit把草稿一次写到底下的历法上（一次保存、一次通知），没有commit就在退出时丢掉
+    """
+
+    def __new__(cls, base: DatetimeContext):
+        self = object.__new__(cls)
+        self._init_fields(base)
+        self._base = base
+        self._file_cache = OverlayCacheLine(base._file_cache)
+        return self
+
+    @property
+    def base(self) -> DatetimeContext:
+        return self._base
+
+    @property
+    def dirty(self) -> bool:
+        """草稿上有没有修改"""
+        data = self._file_cache.file_data
+        return data.prefix_len < len(self._base._file_cache.file_data) or bool(data.tail)
+
+    def on_change(self, save=True):
+        # 只影响草稿上的MyDateTime
+        self._recalc_bound()
+
+    def get_tuple(self):
+        return super().get_tuple() + ("overlay", id(self))
+
+    def discard(self):
+        """丢掉草稿上的修改"""
+        self._file_cache.reset()
+        self.on_change(save=False)
+
+    def rebase(self):
+        """
+        接受底下的day_time_map现在的样子，草稿上的修改保留。底下被改过之后想继续commit时用
+        """
+        self._file_cache.remember_base()
+
+    def commit(self):
+        """
+        把草稿一次写到底下的历法上：从草稿改过的位置开始整个换成草稿的内容。
+        草稿打开之后底下被改过的话抛出OverlayConflictError，什么也不改
+        """
+        cache = self._file_cache
+        data = cache.file_data
+        with self._base.edit_date() as base_cache:
+            if cache.base_changed(base_cache.file_data):
+                raise OverlayConflictError("预览期间保存文件被修改过", self.save_path)
+            prefix = data._prefix(base_cache.file_data)
+            del base_cache.file_data[prefix:]
+            base_cache.file_data.extend(data.tail)
+        self.discard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.discard()
+
+
 Default_File_Path = None
 
 
@@ -294,6 +1628,87 @@ def _check_date_field(stage, cycle, day, context: DatetimeContext):
     raise ValueError()
 
 
+class SubjectiveDelta:
+    """
+    按本历法的单位计算的时间差：若干天、周、月，再加上一段时分秒。
+
+    加到时间上时直接在“第几天”上加，再从目标那一天的开始加上原来的时刻和时分秒的偏移，
+    只需要查一次day_time_map或者按外推公式算一次，不经过MyDateTime的字段校验。
+    目标那一天比原来那一天短的话，结果可能落到再下一天
+    """
+    __slots__ = ("days", "cycles", "stages", "microseconds")
+
+    def __init__(self, days: int = 0, cycles: int = 0, stages: int = 0,
+                 hours: float = 0, minutes: float = 0, seconds: float = 0, microseconds: float = 0):
+        self.days = _check_int_field(days)
+        self.cycles = _check_int_field(cycles)
+        self.stages = _check_int_field(stages)
+        self.microseconds = timedelta(hours=hours, minutes=minutes, seconds=seconds,
+                                      microseconds=microseconds) // _ONE_US
+
+    @classmethod
+    def _of(cls, days, cycles, stages, microseconds) -> SubjectiveDelta:
+        self = object.__new__(cls)
+        self.days, self.cycles, self.stages, self.microseconds = days, cycles, stages, microseconds
+        return self
+
+    @property
+    def time(self) -> timedelta:
+        """时分秒的偏移"""
+        return timedelta(microseconds=self.microseconds)
+
+    def total_days(self, context: DatetimeContext) -> int:
+        return self.days + (self.cycles + self.stages * context.cycle_per_stage) * context.day_per_cycle
+
+    def apply_us(self, context: DatetimeContext, total_day: int, us: int) -> int:
+        """第total_day天开始后us微秒的时刻，加上这个时间差之后的时间戳（微秒）"""
+        total_day += self.total_days(context)
+        if total_day < 0:
+            raise ValueError("纪元前时间无定义", total_day)
+        return context.get_timestamp_us(total_day, us + self.microseconds)
+
+    def _tuple(self):
+        return self.days, self.cycles, self.stages, self.microseconds
+
+    def __add__(self, other):
+        if not isinstance(other, SubjectiveDelta):
+            return NotImplemented
+        return self._of(*(a + b for a, b in zip(self._tuple(), other._tuple())))
+
+    def __sub__(self, other):
+        if not isinstance(other, SubjectiveDelta):
+            return NotImplemented
+        return self + -other
+
+    def __neg__(self):
+        return self._of(*(-a for a in self._tuple()))
+
+    def __mul__(self, other: int):
+        if not isinstance(other, int):
+            return NotImplemented
+        return self._of(*(a * other for a in self._tuple()))
+
+    __rmul__ = __mul__
+
+    def __eq__(self, other):
+        if not isinstance(other, SubjectiveDelta):
+            return NotImplemented
+        return self._tuple() == other._tuple()
+
+    def __hash__(self):
+        return hash(self._tuple())
+
+    def __bool__(self):
+        return any(self._tuple())
+
+    def __repr__(self):
+        fields = [f"{name}={value}" for name, value in zip(("days", "cycles", "stages"), self._tuple())
+                  if value]
+        if self.microseconds:
+            fields.append(f"time={self.time}")
+        return f"SubjectiveDelta({', '.join(fields)})"
+
+
 @total_ordering
 class MyDateTime:
     _default_context = None
@@ -308,7 +1723,6 @@ class MyDateTime:
                  microsecond=0, context=..., **kwargs):
         if context is ...:
             context = self.get_default_context()
-        context.bind(self)
         if not kwargs.get("skip_check", False):
             hour, minute, second, microsecond = _check_time_fields(
                 hour, minute, second, microsecond, context)
@@ -323,114 +1737,99 @@ class MyDateTime:
         self._microsecond = microsecond
         self._hashcode = -1
         self._context = context
-        self._timestamp = kwargs.get("_force_timestamp")
-        if self._timestamp is None:
-            self.timestamp()
-        self.re_calc_datetime()  # 要判断一个日期是合法的，太难了，所以重新从时间戳中计算一次
+        self._timestamp_us = kwargs.get("_force_timestamp_us")
+        # 算完再绑定：修改之后重新计算的可能是别的线程，不能让它看到还没有时间戳的对象。
+        # 计算和绑定之间也不能漏掉一次修改，所以一起放在锁里
+        with context._bind_lock:
+            if self._timestamp_us is None:
+                self.timestamp_us()
+            self.re_calc_datetime()  # 要判断一个日期是合法的，太难了，所以重新从时间戳中计算一次
+            context.bind(self)
 
     def re_calc_datetime(self):
         self._stage, self._cycle, self._day, self._hour, self._minute, self._second, self._microsecond \
-            = self._from_timestamp_internal(self._timestamp, self._context)
+            = self._from_timestamp_internal(self._timestamp_us, self._context)
 
     @classmethod
-    def _from_timestamp_internal(cls, t: float, context: DatetimeContext):
-        total_day, t = context.get_total_day(t)
-        frac, t = math.modf(t)
-        t = int(t)
-        us = round(frac * 1e6)
-        if us >= 1000000:
-            t += 1
-            us -= 1000000
-        elif us < 0:
-            t -= 1
-            us += 1000000
-
-        ss = t % 60
-        t //= 60
-        mm = t % 60
-        t //= 60
-        hh = t
-
-        d = total_day % context.day_per_cycle + 1
-        total_day //= context.day_per_cycle
-        c = total_day % context.cycle_per_stage + 1
-        s = total_day // context.cycle_per_stage + 1
-        return s, c, d, hh, mm, ss, us
+    def _from_timestamp_internal(cls, t: int, context: DatetimeContext):
+        total_day, t = context.get_total_day_us(t)
+        t, us = divmod(t, US_PER_SEC)
+        t, ss = divmod(t, 60)
+        hh, mm = divmod(t, 60)
+
+        total_day, d = divmod(total_day, context.day_per_cycle)
+        s, c = divmod(total_day, context.cycle_per_stage)
+        return s + 1, c + 1, d + 1, hh, mm, ss, us
 
     @classmethod
     def from_timestamp(cls, t: float, context=...):
+        return cls.from_timestamp_us(sec_to_us(t), context)
+
+    @classmethod
+    def from_timestamp_us(cls, t: int, context=...):
         if context is ...:
             context = cls.get_default_context()
-        if t - context.zero_point < 0:
+        if t < context.zero_point_us:
             raise ValueError("纪元前时间无定义")
 
-        return cls(*cls._from_timestamp_internal(t, context), _force_timestamp=t)
+        return cls(*cls._from_timestamp_internal(t, context), context=context, _force_timestamp_us=t)
 
     def timestamp(self) -> float:
-        if self._timestamp is not None:
-            return self._timestamp
-        t = 0
-        context = self._context
+        return self.timestamp_us() / US_PER_SEC
 
-        t += self.stage - 1
-        t *= context.cycle_per_stage
-        t += self.cycle - 1
-        t *= context.day_per_cycle
-        t += self.day - 1
-        total_day = t
-        t = 0
-        t += self.hour
-        t *= 60
-        t += self.minute
-        t *= 60
-        t += self.second
-        t += self.microsecond * 1e-6
-        sec = t
-        self._timestamp = context._file_cache \
-            .get_timestamp(total_day, sec,
-                           int(context.hour_per_day * 3600),
-                           context.zero_point)
-        return self._timestamp
+    def timestamp_us(self) -> int:
+        if self._timestamp_us is not None:
+            return self._timestamp_us
+        self._timestamp_us = self._context.get_timestamp_us(*self._day_and_us())
+        return self._timestamp_us
 
-    def __hash__(self):
-        hash(self.timestamp())
+    def _day_and_us(self):
+        """(从纪元开始的第几天, 这一天开始后的微秒数)"""
+        context = self._context
+        total_day = ((self.stage - 1) * context.cycle_per_stage + self.cycle - 1) * context.day_per_cycle \
+                    + self.day - 1
+        us = ((self.hour * 60 + self.minute) * 60 + self.second) * US_PER_SEC + self.microsecond
+        return total_day, us
 
-    def __lt__(self, other):
+    def _other_timestamp_us(self, other):
         if isinstance(other, MyDateTime):
-            return self.timestamp() < other.timestamp()
+            return other.timestamp_us()
 
         if isinstance(other, datetime):
-            if other.tzinfo and other.tzinfo.utcoffset(other):
-                return self.timestamp() < other.timestamp()
+            if is_aware(other):
+                return datetime_to_us(other)
             raise TypeError("必须是带有时区的绝对时间")
         raise TypeError("不支持比较")
 
-    def __eq__(self, other):
-        if isinstance(other, MyDateTime):
-            return self.timestamp() == other.timestamp()
+    def __hash__(self):
+        return hash(self.timestamp_us())
 
-        if isinstance(other, datetime):
-            if other.tzinfo and other.tzinfo.utcoffset(other):
-                return self.timestamp() == other.timestamp()
-            raise TypeError("必须是带有时区的绝对时间")
-        raise TypeError("不支持比较")
+    def __lt__(self, other):
+        return self.timestamp_us() < self._other_timestamp_us(other)
+
+    def __eq__(self, other):
+        return self.timestamp_us() == self._other_timestamp_us(other)
 
-    def __add__(self, other: timedelta):
-        return self.from_timestamp(self.timestamp() + other.total_seconds())
+    def __add__(self, other: timedelta | SubjectiveDelta):
+        if isinstance(other, SubjectiveDelta):
+            return self.from_timestamp_us(other.apply_us(self._context, *self._day_and_us()), self._context)
+        return self.from_timestamp_us(self.timestamp_us() + other // _ONE_US, self._context)
 
     __radd__ = __add__
 
-    def __sub__(self, other: timedelta | MyDateTime | datetime):
+    def __sub__(self, other: timedelta | SubjectiveDelta | MyDateTime | datetime):
+        if isinstance(other, SubjectiveDelta):
+            return self + -other
         if isinstance(other, timedelta):
-            return self.from_timestamp(self.timestamp() - other.total_seconds())
+            return self.from_timestamp_us(self.timestamp_us() - other // _ONE_US, self._context)
 
         if isinstance(other, MyDateTime):
-            other_timestamp = other.timestamp()
+            other_timestamp = other.timestamp_us()
         elif isinstance(other, datetime):
-            other_timestamp = other.timestamp()
+            other_timestamp = datetime_to_us(other)
         else:
             raise TypeError()
-        return timedelta(seconds=self.timestamp() - other_timestamp)
+        return timedelta(microseconds=self.timestamp_us() - other_timestamp)
 
     def __rsub__(self, other):
         return -(self - other)
@@ -473,17 +1872,49 @@ class MyDateTime:
 
     @classmethod
     def from_datetime(cls, dt: datetime) -> MyDateTime:
-        if dt.tzinfo and dt.tzinfo.utcoffset(dt):
-            return cls.from_timestamp(dt.timestamp())
+        if is_aware(dt):
+            return cls.from_timestamp_us(datetime_to_us(dt))
         raise TypeError("必须是带有时区的绝对时间")
 
-    def to_datetime(self, tzinfo_: tzinfo = None):
-        return datetime.fromtimestamp(self.timestamp(),
-                                      tz=tzinfo_ if tzinfo_ else datetime(2000, 1, 1).astimezone().tzinfo)
+    def to_datetime(self, tzinfo_: Zone | tzinfo | str = None):
+        """
+        换算成tzinfo_时区的datetime，可以是tzinfo、IANA时区名，默认是本地时区（用这一时刻的偏移）
+        """
+        return get_zone(tzinfo_).to_datetime(self.timestamp_us())
 
     @classmethod
-    def now(cls) -> MyDateTime:
-        return cls.from_timestamp(time.time())
+    def now(cls, context=...) -> MyDateTime:
+        if context is ...:
+            context = cls.get_default_context()
+        return cls.from_timestamp_us(context.clock.now_us(), context)
+
+    @classmethod
+    async def now_stream(cls, context=..., unit: str = "second", max_sleep: float = 60.):
+        """
+        异步地不断产生当前时间：先产生一次，之后unit="second"时每到新的一秒产生一次，
+        unit="day"时每到新的一天产生一次。
+
+        最多睡max_sleep秒就重新看一次钟，分界点被修改或者钟被拨动了也能跟上
+        """
+        if context is ...:
+            context = cls.get_default_context()
+        if unit not in ("second", "day"):
+            raise ValueError("unit只能是second或day", unit)
+        await context.aload()
+        last = None
+        while True:
+            now_us = context.clock.now_us()
+            total_day, us = context.get_total_day_us(now_us)
+            key = (total_day, us // US_PER_SEC) if unit == "second" else total_day
+            if key != last:
+                last = key
+                yield cls.from_timestamp_us(now_us, context)
+                continue
+            if unit == "second":
+                delay = US_PER_SEC - us % US_PER_SEC
+            else:
+                delay = context.day_start_us(total_day + 1) - now_us
+            await asyncio.sleep(min(delay / US_PER_SEC, max_sleep))
 
     def __str__(self):
         return f"{self.stage}-{self.cycle}-{self.day} " + \
@@ -493,7 +1924,7 @@ class MyDateTime:
         return f"<MyDatetime {self!s}>"
 
 
-__all__ = ["DatetimeContext", "MyDateTime"]
+__all__ = ["DatetimeContext", "OverlayContext", "MyDateTime", "SubjectiveDelta"]
 
 # 测试样例
 # with MyDateTime.get_default_context().edit_date() as c:
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# @File    : repair.py
+# @Date    : 2026-10-19
+# @Author  : 王超逸
+# @Brief   : 检查保存文件和备份，需要时用能读出来的数据重新写一份完好的保存文件
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+from mytime import FileCacheLine
+
+
+def check_file(save_path: Path, path: Path) -> tuple[int | None, Exception | None]:
+    """严格读取save_path的保存文件或者备份path，返回(分界点个数, 错误)"""
+    if not path.exists():
+        return None, None
+    # 每次用新的缓存，互不影响冷存储的状态。冷文件的名字跟着保存文件走，备份也用同样的冷文件
+    file_cache = FileCacheLine(save_path)
+    try:
+        return len(file_cache._read_save(path)), None
+    except Exception as e:
+        return None, e
+
+
+def repair(save_path: Path, fix=False, out=print) -> bool:
+    """
+    报告保存文件和.bak的情况。fix为True并且保存文件有问题时，按正常读取的顺序
+    （保存文件、.bak、前面完好的部分）取出数据重新保存。返回保存文件现在是否完好
+    """
+    save_path = save_path.resolve()
+    file_cache = FileCacheLine(save_path)
+    for path in (save_path, file_cache.bak_file_path):
+        count, error = check_file(save_path, path)
+        if count is None and error is None:
+            out(f"{path}: 不存在")
+        elif error is None:
+            out(f"{path}: 完好，{count}个分界点")
+        else:
+            out(f"{path}: 已损坏，{error!r}")
+
+    count, error = check_file(save_path, save_path)
+    if error is None:
+        return True
+    if not fix:
+        out("加上--fix来修复")
+        return False
+    with file_cache.lock:
+        file_cache.reload()
+        report = file_cache.last_load
+        if report.source is None:
+            out("没有能读出来的数据")
+            return False
+        file_cache.save()
+    how = "前面完好的部分" if report.salvaged else "全部"
+    out(f"从{report.source}中取出了{how}，{report.count}个分界点，已重新保存；损坏的文件另存为.corrupt")
+    return check_file(save_path, save_path)[1] is None
+
+
+def main(argv=None):
+    import path_def
+    path_def.init_path(__file__)
+
+    parser = argparse.ArgumentParser(description="检查、修复本钟的保存文件")
+    parser.add_argument("--save", type=Path, help="保存文件，默认和窗口程序用同一个")
+    parser.add_argument("--fix", action="store_true", help="保存文件有问题时重新写一份")
+    args = parser.parse_args(argv)
+
+    save_path = args.save or path_def.ENTRY_POINT_DIR / "saves" / "save_data.txt"
+    if not repair(save_path, args.fix):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# @File    : simulate.py
+# @Date    : 2026-10-19
+# @Author  : 王超逸
+# @Brief   : 用虚拟时间模拟多年的使用，观察历史变长之后保存和查询的开销
+from __future__ import annotations
+
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+
+import command
+from clock import FixedClock
+from mytime import DatetimeContext, MyDateTime, US_PER_SEC
+
+HOUR_US = 3600 * US_PER_SEC
+
+
+class Simulation:
+    """
+    在一个临时的保存文件上，按照随机生成的作息推进虚拟时间并执行命令。
+
+    每天：醒着awake小时后说晚安，睡sleep小时；偶尔在醒来后设置今天的小时数，偶尔熬夜用“今天是昨天”
+    """
+
+    def __init__(self, save_path: Path, seed=0, start_us: int = None,
+                 awake_hours=(18., 2.), sleep_hours=(8., 1.), set_hours_rate=0.1, yesterday_rate=0.05):
+        self.random = random.Random(seed)
+        self.clock = FixedClock(start_us)
+        self.context = DatetimeContext(self.clock.now_us() // US_PER_SEC, 26, 7, 4, save_path)
+        self.context.clock = self.clock
+        self.awake_hours = awake_hours
+        self.sleep_hours = sleep_hours
+        self.set_hours_rate = set_hours_rate
+        self.yesterday_rate = yesterday_rate
+        self.days = 0
+        self.save_costs: list[float] = []
+
+    def _hours(self, mean_stdev, low=1.):
+        return max(low, self.random.gauss(*mean_stdev))
+
+    def _run_command(self, func, *args):
+        start = time.perf_counter()
+        func(*args, context=self.context)
+        self.save_costs.append(time.perf_counter() - start)
+
+    def step(self):
+        """模拟一天"""
+        clock = self.clock
+        awake = self._hours(self.awake_hours, low=13)
+        if self.random.random() < self.set_hours_rate:
+            clock.advance(HOUR_US)
+            self._run_command(command.set_today_hours, round(self._hours(self.sleep_hours) + awake))
+            awake -= 1
+        clock.advance(int(awake * HOUR_US))
+        if self.random.random() < self.yesterday_rate:
+            self._run_command(command.today_is_yesterday)
+            clock.advance(HOUR_US // 2)
+        self._run_command(command.good_night)
+        clock.advance(int(self._hours(self.sleep_hours) * HOUR_US))
+        self.days += 1
+
+    def measure_lookup(self, samples=1000) -> float:
+        """在整个历史中随机取时间转换成MyDateTime，返回平均耗时（秒）"""
+        context = self.context
+        low = context.zero_point_us
+        high = self.clock.now_us()
+        points = [self.random.randrange(low, high) for _ in range(samples)]
+        start = time.perf_counter()
+        for t in points:
+            MyDateTime.from_timestamp_us(t, context)
+        return (time.perf_counter() - start) / samples
+
+    def disk_usage(self) -> int:
+        path = self.context.save_path
+        return sum(p.stat().st_size for p in path.parent.glob(path.name + "*") if not p.name.endswith(".bak"))
+
+    def report(self, lookup_samples=1000) -> dict:
+        costs = self.save_costs
+        self.save_costs = []
+        return {
+            "days": self.days,
+            "virtual_years": (self.clock.now_us() - self.context.zero_point_us) / (365.25 * 24 * HOUR_US),
+            "history": len(self.context._file_cache.file_data),
+            "disk_bytes": self.disk_usage(),
+            "edit_ms": statistics.mean(costs) * 1000 if costs else 0.,
+            "edit_max_ms": max(costs) * 1000 if costs else 0.,
+            "lookup_us": self.measure_lookup(lookup_samples) * 1e6,
+        }
+
+
+def run(years=30., report_every=365, seed=0, save_dir: Path = None, out=print):
+    with tempfile.TemporaryDirectory() as tmp:
+        save_path = (save_dir or Path(tmp)) / "saves" / "save_data.txt"
+        sim = Simulation(save_path, seed=seed)
+        out(f"{'days':>7} {'years':>6} {'history':>8} {'disk':>8} {'edit ms':>8} {'max ms':>8} {'lookup us':>10}")
+        start = time.perf_counter()
+        end_us = sim.clock.now_us() + int(years * 365.25 * 24 * HOUR_US)
+        reports = []
+        while sim.clock.now_us() < end_us:
+            sim.step()
+            if sim.days % report_every == 0:
+                r = sim.report()
+                reports.append(r)
+                out(f"{r['days']:>7} {r['virtual_years']:>6.1f} {r['history']:>8} {r['disk_bytes']:>8} "
+                    f"{r['edit_ms']:>8.2f} {r['edit_max_ms']:>8.2f} {r['lookup_us']:>10.1f}")
+        out(f"模拟了{timedelta(microseconds=sim.clock.now_us() - sim.context.zero_point_us)}，"
+            f"实际用时{time.perf_counter() - start:.1f}秒")
+        return reports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="用虚拟时间模拟长期使用")
+    parser.add_argument("--years", type=float, default=30)
+    parser.add_argument("--report-every", type=int, default=365, help="每多少天输出一行")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-dir", type=Path, help="保存文件放在哪里，默认用临时文件夹")
+    args = parser.parse_args(argv)
+    run(args.years, args.report_every, args.seed, args.save_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# @File    : stage_grid.py
+# @Date    : 2026-10-19
+# @Author  : 王超逸
+# @Brief   : 一个月（stage）里每一天的起止，一次批量查询算出整个表格，之后只更新变化了的格子
+from __future__ import annotations
+
+from datetime import timedelta
+from typing import NamedTuple
+
+from mytime import DatetimeContext, MyDateTime
+
+
+class DayCell(NamedTuple):
+    total_day: int
+    stage: int
+    cycle: int
+    day: int
+    start_us: int
+    end_us: int
+
+    @property
+    def length(self) -> timedelta:
+        return timedelta(microseconds=self.end_us - self.start_us)
+
+    def progress(self, now_us: int) -> float:
+        """这一天过去了多少，0到1"""
+        if now_us <= self.start_us:
+            return 0.
+        if now_us >= self.end_us:
+            return 1.
+        return (now_us - self.start_us) / (self.end_us - self.start_us)
+
+
+class StageGrid:
+    """
+    cycle_per_stage行、day_per_cycle列的表格。refresh时用DatetimeContext.day_starts_us一次取出
+    这个月所有的分界点，和上一次的比较，只重建起止变了的格子。平时的修改只动最后一天，
+    过去的格子不会变，只有今天和之后外推出来的格子需要重建
+    """
+
+    def __init__(self, context=..., stage: int = None):
+        if context is ...:
+            context = MyDateTime.get_default_context()
+        self.context: DatetimeContext = context
+        # None表示跟着当前时间走
+        self.fixed_stage = stage
+        self.stage: int | None = None
+        self.cells: list[DayCell] = []
+        self._starts: list[int] = []
+        self._revision = None
+
+    @property
+    def rows(self):
+        return self.context.cycle_per_stage
+
+    @property
+    def columns(self):
+        return self.context.day_per_cycle
+
+    def _current_stage(self, now_us: int) -> int:
+        total_day, _ = self.context.get_total_day_us(now_us)
+        return total_day // (self.rows * self.columns) + 1
+
+    def refresh(self, now_us: int = None) -> set[int]:
+        """
+        返回起止有变化的格子的下标，换了一个月时返回全部
+        """
+        context = self.context
+        if now_us is None:
+            now_us = context.clock.now_us()
+        stage = self.fixed_stage or self._current_stage(now_us)
+        revision = context._file_cache.revision
+        if stage == self.stage and revision == self._revision:
+            return set()
+        n = self.rows * self.columns
+        first = (stage - 1) * n
+        starts = context.day_starts_us(first, first + n)
+        if stage != self.stage:
+            changed = set(range(n))
+        else:
+            old = self._starts
+            changed = {i for i in range(n) if starts[i] != old[i] or starts[i + 1] != old[i + 1]}
+        if changed:
+            cells = self.cells if stage == self.stage else [None] * n
+            for i in changed:
+                cycle, day = divmod(i, self.columns)
+                cells[i] = DayCell(first + i, stage, cycle + 1, day + 1, starts[i], starts[i + 1])
+            self.cells = cells
+        self.stage = stage
+        self._starts = starts
+        self._revision = revision
+        return changed
+
+    def index_of(self, now_us: int) -> int | None:
+        """now_us落在哪个格子里，不在这个月里返回None"""
+        starts = self._starts
+        if not starts or not starts[0] <= now_us < starts[-1]:
+            return None
+        for i, cell in enumerate(self.cells):
+            if now_us < cell.end_us:
+                return i
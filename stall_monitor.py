@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+# @File    : stall_monitor.py
+# @Date    : 2026-10-19
+# @Author  : 王超逸
+# @Brief   : 界面卡顿监视。GUI线程定时心跳，后台线程发现心跳停了太久就抓GUI线程的调用栈
+from __future__ import annotations
+
+import collections
+import json
+import logging
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime
+from pathlib import Path
+from typing import NamedTuple
+
+import activity
+
+log = logging.getLogger(__name__)
+
+
+class Stall(NamedTuple):
+    # 卡住开始时的time.time()
+    start: float
+    # 秒
+    duration: float
+    # 卡住期间看到过的引擎操作，每一项是"外层 > 内层"
+    operations: tuple[str, ...]
+    # 超过阈值那一刻GUI线程的调用栈，外层在前
+    stack: tuple[str, ...]
+
+    def to_dict(self) -> dict:
+        return {
+            "start": datetime.fromtimestamp(self.start).astimezone().isoformat(timespec="milliseconds"),
+            "duration_ms": round(self.duration * 1000, 1),
+            "operations": list(self.operations),
+            "stack": list(self.stack),
+        }
+
+    def __str__(self):
+        start = time.strftime("%H:%M:%S", time.localtime(self.start))
+        return f"{start} 卡了{self.duration * 1000:.0f}ms  {'; '.join(self.operations) or '(不在引擎操作中)'}"
+
+
+class StallMonitor:
+    """
+    GUI线程每interval秒调用一次beat()，后台线程每interval秒看一次：
+    离上一次心跳超过threshold秒就算卡住了，抓一次GUI线程的调用栈和当时的引擎操作，
+    之后一直记录看到的操作，直到心跳恢复，记下卡了多久。
+
+    心跳之间多出来的时间就是事件循环的延迟，也顺便统计。
+    后台线程自己也睡过头（比如电脑休眠了）的话，那一段不算卡顿
+    """
+
+    def __init__(self, thread_id: int = None, interval=0.1, threshold=0.5, capacity=100):
+        self.thread_id = threading.main_thread().ident if thread_id is None else thread_id
+        self.interval = interval
+        self.threshold = threshold
+        self.stalls: collections.deque[Stall] = collections.deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._last_beat = None
+        self._pending = None
+        self._thread = None
+        self._stop = threading.Event()
+        # 驱动beat()的定时器，有的话暂停时一起停
+        self.timer = None
+        self.beats = 0
+        self.total_latency = 0.
+        self.max_latency = 0.
+
+    def beat(self):
+        """在GUI线程中定时调用"""
+        now = time.perf_counter()
+        with self._lock:
+            if self._last_beat is not None:
+                latency = max(0., now - self._last_beat - self.interval)
+                self.beats += 1
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+            pending = self._pending
+            if pending is not None:
+                self._pending = None
+                stall = pending._replace(duration=now - self._last_beat)
+                self.stalls.append(stall)
+            self._last_beat = now
+        if pending is not None:
+            log.warning("界面卡顿：%s", stall)
+
+    def _check(self, now: float):
+        with self._lock:
+            last_beat = self._last_beat
+            if last_beat is None or now - last_beat < self.threshold:
+                return
+            operations = " > ".join(activity.current(self.thread_id))
+            pending = self._pending
+            if pending is None:
+                frame = sys._current_frames().get(self.thread_id)
+                stack = tuple(line.rstrip() for line in traceback.format_stack(frame)) if frame else ()
+                self._pending = Stall(time.time() - (now - last_beat), now - last_beat,
+                                      (operations,) if operations else (), stack)
+            elif operations and operations not in pending.operations:
+                self._pending = pending._replace(operations=pending.operations + (operations,))
+
+    def _run(self):
+        expected = time.perf_counter() + self.interval
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            if now - expected > self.threshold:
+                # 自己也没按时醒，是整个进程被挂起了，重新开始计
+                with self._lock:
+                    self._last_beat = None
+                    self._pending = None
+            else:
+                self._check(now)
+            expected = now + self.interval
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stall-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def set_active(self, active: bool):
+        """
+        暂停（比如窗口看不见了）或者恢复。暂停时心跳定时器和后台线程都停掉，不再醒；
+        恢复时从头开始计，暂停期间不算卡顿
+        """
+        if not active:
+            self.stop()
+            if self.timer is not None:
+                self.timer.stop()
+            return
+        with self._lock:
+            self._last_beat = None
+            self._pending = None
+        if self.timer is not None:
+            self.timer.start()
+        self.start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "beats": self.beats,
+                "mean_latency_ms": round(self.total_latency / self.beats * 1000, 2) if self.beats else 0.,
+                "max_latency_ms": round(self.max_latency * 1000, 1),
+                "stalls": len(self.stalls),
+            }
+
+    def history(self) -> list[Stall]:
+        with self._lock:
+            return list(self.stalls)
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "threshold_ms": self.threshold * 1000,
+            "interval_ms": self.interval * 1000,
+            "stats": self.stats(),
+            "stalls": [stall.to_dict() for stall in self.history()],
+        }, ensure_ascii=False, indent=2)
+
+    def export_json(self, path: Path):
+        Path(path).write_text(self.to_json(), encoding="utf-8")
+
+
+def install(parent, interval=0.1, threshold=0.5, capacity=100) -> StallMonitor:
+    """
+    在当前（GUI）线程上开始监视：心跳用挂在parent上的QTimer，随parent一起销毁。
+    parent看不见的时候用set_active(False)暂停
+    """
+    from PyQt5.QtCore import QTimer
+
+    monitor = StallMonitor(threading.get_ident(), interval, threshold, capacity)
+    timer = QTimer(parent)
+    timer.setInterval(round(interval * 1000))
+    timer.timeout.connect(monitor.beat)
+    timer.destroyed.connect(lambda *_: monitor.stop())
+    monitor.timer = timer
+    monitor.set_active(True)
+    return monitor
+
+
+__all__ = ["Stall", "StallMonitor", "install"]
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# @File    : stress_lock.py
+# @Date    : 2026-10-19
+# @Author  : 王超逸
+# @Brief   : 多个进程同时修改同一个保存文件，检查每一次修改都留下来了，顺便看抢锁的开销
+from __future__ import annotations
+
+import argparse
+import multiprocessing
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from mytime import DatetimeContext, FileCacheLine, US_PER_SEC
+
+ZERO_POINT = 1_700_000_000
+
+
+def _writer(save_path: str, edits: int, results):
+    """
+    在子进程中运行：edits次，每次在末尾追加比最后一个大一秒的时刻，记下每次edit_date的耗时。
+    出错了也要交回结果，不然主进程会一直等
+    """
+    costs = []
+    error = None
+    try:
+        context = DatetimeContext(ZERO_POINT, 26, 7, 4, Path(save_path))
+        for _ in range(edits):
+            start = time.perf_counter()
+            with context.edit_date() as data_cache:
+                data = data_cache.file_data
+                data.append(data[-1] + US_PER_SEC)
+            costs.append(time.perf_counter() - start)
+    except Exception as e:
+        error = repr(e)
+    results.put((costs, error))
+
+
+class LockStress:
+    """
+    procs个进程各自用自己的DatetimeContext，在同一个保存文件上做edits次读-改-写。
+
+    每次修改都是“在最后一个时刻上加一秒再追加”，只要有一次是在旧的数据上改的，
+    就会有两次修改写出同一个值，最后的文件就会比procs * edits短，或者不是连续的
+    """
+
+    def __init__(self, save_path: Path, procs=16, edits=50):
+        self.save_path = save_path
+        self.procs = procs
+        self.edits = edits
+        self.costs: list[float] = []
+        self.elapsed = 0.
+
+    def run(self):
+        # 先写出纪元，所有进程都从同一个文件开始
+        context = DatetimeContext(ZERO_POINT, 26, 7, 4, self.save_path)
+        with context.edit_date() as data_cache:
+            data_cache.file_data[:] = [ZERO_POINT * US_PER_SEC]
+        # Windows上只有spawn，这里也用spawn，每个进程从头加载保存文件
+        mp = multiprocessing.get_context("spawn")
+        results = mp.Queue()
+        processes = [mp.Process(target=_writer, args=(str(self.save_path), self.edits, results))
+                     for _ in range(self.procs)]
+        start = time.perf_counter()
+        for p in processes:
+            p.start()
+        # 先取结果再join，队列满了子进程会退不出
+        errors = []
+        for _ in processes:
+            costs, error = results.get()
+            self.costs.extend(costs)
+            if error is not None:
+                errors.append(error)
+        for p in processes:
+            p.join()
+        self.elapsed = time.perf_counter() - start
+        assert not errors, f"有{len(errors)}个进程出错：{errors[0]}"
+
+    def check(self):
+        """从磁盘重新读一遍，每一次修改都要在"""
+        data = list(FileCacheLine(self.save_path).file_data)
+        expected = [ZERO_POINT * US_PER_SEC + i * US_PER_SEC for i in range(self.procs * self.edits + 1)]
+        assert len(data) == len(expected), f"应该有{len(expected)}项，实际{len(data)}项，丢了修改"
+        assert data == expected, "保存的时刻不连续，有修改是在旧的数据上做的"
+
+    def report(self) -> dict:
+        costs = self.costs
+        return {
+            "edits": len(costs),
+            "elapsed_s": self.elapsed,
+            "edit_ms": statistics.mean(costs) * 1000,
+            "edit_median_ms": statistics.median(costs) * 1000,
+            "edit_max_ms": max(costs) * 1000,
+        }
+
+
+def run(procs=16, edits=50, save_dir: Path = None, out=print):
+    with tempfile.TemporaryDirectory() as tmp:
+        save_path = (save_dir or Path(tmp)) / "saves" / "save_data.txt"
+        stress = LockStress(save_path, procs, edits)
+        stress.run()
+        stress.check()
+        r = stress.report()
+        out(f"{procs}个进程各修改{edits}次，{r['edits']}次修改都保存下来了")
+        out(f"总用时{r['elapsed_s']:.2f}秒，每次修改平均{r['edit_ms']:.2f}ms，"
+            f"中位数{r['edit_median_ms']:.2f}ms，最长{r['edit_max_ms']:.2f}ms")
+        return r
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="多进程同时修改同一个保存文件的压力测试")
+    parser.add_argument("--procs", type=int, default=16, help="同时修改的进程数")
+    parser.add_argument("--edits", type=int, default=50, help="每个进程修改多少次")
+    parser.add_argument("--save-dir", type=Path, help="保存文件放在哪里，默认用临时文件夹")
+    args = parser.parse_args(argv)
+    run(args.procs, args.edits, args.save_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+# @File    : sync.py
+# @Date    : 2026-10-19
+# @Author  : 王超逸
+# @Brief   : 两台设备之间同步day_time_map。按时间范围比较哈希，只交换不同的部分，再按确定的规则合并
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import socket
+import socketserver
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from typing import NamedTuple
+
+from mytime import DatetimeContext, US_PER_SEC
+
+log = logging.getLogger(__name__)
+
+# 比较的范围都是时间戳（微秒）的区间，从整个时间轴开始，每层分成FANOUT份，两边的划分完全一样
+ROOT_RANGE = (0, 1 << 56)
+FANOUT = 16
+# 两边在一个区间里的分界点都不超过这么多个，就直接交换这个区间的内容，不再往下分
+LEAF_SIZE = 8
+# 两边相差不到这么久的分界点认为是同一天的开始，取较晚的那个（晚一点说的晚安）
+MERGE_WINDOW_US = 6 * 3600 * US_PER_SEC
+# 共享文件夹模式下每个文件存放的时间范围，2**40微秒大约12.7天
+BUCKET_BITS = 40
+DEFAULT_PORT = 47326
+
+
+def _hash(values) -> str:
+    return hashlib.blake2b(array("q", values).tobytes(), digest_size=8).hexdigest()
+
+
+def _slice(values: list[int], lo: int, hi: int) -> list[int]:
+    return values[bisect_left(values, lo):bisect_left(values, hi)]
+
+
+def _split(lo: int, hi: int) -> list[tuple[int, int]]:
+    step = (hi - lo) // FANOUT
+    return [(lo + i * step, lo + (i + 1) * step) for i in range(FANOUT)]
+
+
+def summarize(values: list[int], ranges, split=False) -> list[list]:
+    """每个区间里分界点的[个数, 哈希]。split为True时对每个区间的FANOUT个子区间计算"""
+    if split:
+        ranges = [r for lo, hi in ranges for r in _split(lo, hi)]
+    out = []
+    for lo, hi in ranges:
+        part = _slice(values, lo, hi)
+        out.append([len(part), _hash(part)])
+    return out
+
+
+def merge(a: list[int], b: list[int], window: int = MERGE_WINDOW_US) -> list[int]:
+    """
+    一遍合并两个递增的分界点列表。相差不到window的两个点算同一天的开始，取较晚的；
+    只有一边有的点保留。结果和参数的顺序无关，merge(a, a) == a
+    """
+    out = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        x, y = a[i], b[j]
+        if abs(x - y) < window:
+            v = max(x, y)
+            i += 1
+            j += 1
+        elif x < y:
+            v = x
+            i += 1
+        else:
+            v = y
+            j += 1
+        # 取了较晚的点之后，另一边落在这一天里面的点就不要了
+        if not out or v > out[-1]:
+            out.append(v)
+    for v in a[i:] or b[j:]:
+        if not out or v > out[-1]:
+            out.append(v)
+    return out
+
+
+def _replace_ranges(values: list[int], ranges, parts) -> list[int]:
+    """把values中落在各个区间（递增、不相交）里的部分换成parts"""
+    out = []
+    pos = 0
+    for (lo, hi), part in zip(ranges, parts):
+        start = bisect_left(values, lo, pos)
+        out.extend(values[pos:start])
+        out.extend(part)
+        pos = bisect_left(values, hi, start)
+    out.extend(values[pos:])
+    return out
+
+
+def _read_values(context: DatetimeContext) -> list[int]:
+    file_cache = context._file_cache
+    with file_cache.lock:
+        file_cache.reload_if_changed()
+        return list(file_cache.file_data)
+
+
+def apply_merge(context: DatetimeContext, ranges, parts, window: int = MERGE_WINDOW_US) -> bool:
+    """
+    对方的数据 = 自己的数据把ranges换成parts。和对方合并之后写回，可以撤销。有变化返回True
+    """
+    with context.edit_date() as data_cache:
+        own = list(data_cache.file_data)
+        merged = merge(own, _replace_ranges(own, ranges, parts), window)
+        if merged == own:
+            return False
+        p = 0
+        for p, (x, y) in enumerate(zip(own, merged)):
+            if x != y:
+                break
+        else:
+            p = min(len(own), len(merged))
+        del data_cache.file_data[p:]
+        data_cache.file_data.extend(merged[p:])
+    log.info("和对方合并了%s，从第%d天开始有变化", context.save_path, p)
+    return True
+
+
+class LocalPeer:
+    """
+    同一台机器上的另一份保存文件。socket服务端收到的请求也交给它处理
+    """
+
+    def __init__(self, context: DatetimeContext):
+        self.context = context
+
+    def summaries(self, ranges, split=False) -> list[list]:
+        return summarize(_read_values(self.context), ranges, split)
+
+    def values(self, ranges) -> list[list[int]]:
+        values = _read_values(self.context)
+        return [_slice(values, lo, hi) for lo, hi in ranges]
+
+    def merge(self, ranges, parts, window: int = MERGE_WINDOW_US) -> bool:
+        return apply_merge(self.context, ranges, parts, window)
+
+    def handle(self, request: dict) -> dict:
+        op = request.get("op")
+        if op == "summaries":
+            return {"ok": True, "result": self.summaries(request["ranges"], request.get("split", False))}
+        if op == "values":
+            return {"ok": True, "result": self.values(request["ranges"])}
+        if op == "merge":
+            return {"ok": True, "result": self.merge(request["ranges"], request["parts"], request["window"])}
+        return {"ok": False, "error": f"不支持的操作: {op!r}"}
+
+
+class SocketPeer:
+    """
+    通过TCP连接另一台设备上的serve()，一行一个json。记录收发的字节数
+    """
+
+    def __init__(self, host: str, port: int = DEFAULT_PORT, timeout=30.):
+        self._sock = socket.create_connection((host, port), timeout=timeout)
+        self._fp = self._sock.makefile("rwb")
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def _call(self, request: dict):
+        line = json.dumps(request, separators=(",", ":")).encode("utf-8") + b"\n"
+        self._fp.write(line)
+        self._fp.flush()
+        reply_line = self._fp.readline()
+        self.bytes_sent += len(line)
+        self.bytes_received += len(reply_line)
+        if not reply_line:
+            raise ConnectionError("对方断开了连接")
+        reply = json.loads(reply_line)
+        if not reply["ok"]:
+            raise RuntimeError(reply["error"])
+        return reply["result"]
+
+    def summaries(self, ranges, split=False) -> list[list]:
+        return self._call({"op": "summaries", "ranges": ranges, "split": split})
+
+    def values(self, ranges) -> list[list[int]]:
+        return self._call({"op": "values", "ranges": ranges})
+
+    def merge(self, ranges, parts, window: int = MERGE_WINDOW_US) -> bool:
+        return self._call({"op": "merge", "ranges": ranges, "parts": parts, "window": window})
+
+    def close(self):
+        self._fp.close()
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class SyncResult(NamedTuple):
+    # 内容不同、交换了的区间
+    ranges: list
+    local_changed: bool
+    remote_changed: bool
+
+
+def sync(context: DatetimeContext, peer, window: int = MERGE_WINDOW_US) -> SyncResult:
+    """
+    和peer（LocalPeer或者SocketPeer）同步。从整个时间轴开始，只对哈希不同的区间往下细分，
+    最后只交换不同的叶子区间，两边用同样的规则合并，结果一样
+    """
+    own = _read_values(context)
+    pending = [ROOT_RANGE]
+    leaves = []
+    # 第一轮比较整个时间轴，之后只发送需要细分的父区间，子区间由对方自己划分
+    theirs = peer.summaries(pending)
+    while pending:
+        mine = summarize(own, pending)
+        diff = []
+        for (lo, hi), m, t in zip(pending, mine, theirs):
+            if m == t:
+                continue
+            if max(m[0], t[0]) <= LEAF_SIZE or hi - lo <= FANOUT:
+                leaves.append((lo, hi))
+            else:
+                diff.append((lo, hi))
+        if not diff:
+            break
+        theirs = peer.summaries(diff, split=True)
+        pending = [r for lo, hi in diff for r in _split(lo, hi)]
+    if not leaves:
+        return SyncResult([], False, False)
+    leaves.sort()
+    theirs = peer.values(leaves)
+    remote_changed = peer.merge(leaves, [_slice(own, lo, hi) for lo, hi in leaves], window)
+    local_changed = apply_merge(context, leaves, theirs, window)
+    return SyncResult(leaves, local_changed, remote_changed)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        peer = self.server.peer
+        for line in self.rfile:
+            try:
+                reply = peer.handle(json.loads(line))
+            except Exception as e:
+                log.warning("处理同步请求失败: %r", e)
+                reply = {"ok": False, "error": repr(e)}
+            self.wfile.write(json.dumps(reply, separators=(",", ":")).encode("utf-8") + b"\n")
+
+
+def serve(context: DatetimeContext, host="127.0.0.1", port=DEFAULT_PORT):
+    """
+    等待另一台设备来同步。默认只监听本机，要跨设备就传host="0.0.0.0"，
+    注意这样局域网里谁都可以改这份数据
+    """
+    server = socketserver.ThreadingTCPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.peer = LocalPeer(context)
+    log.info("同步服务在%s:%d", *server.server_address[:2])
+    with server:
+        server.serve_forever()
+
+
+##################################################
+# 共享文件夹
+#
+# <文件夹>/<设备名>/index.json  {桶号: [个数, 哈希]}
+# <文件夹>/<设备名>/<桶号>.json  这个桶里的分界点
+# 每台设备只写自己的子文件夹，读别人的索引，只打开哈希不同的桶
+
+
+def _bucket_index(values: list[int]) -> dict[str, list]:
+    buckets: dict[int, list[int]] = {}
+    for v in values:
+        buckets.setdefault(v >> BUCKET_BITS, []).append(v)
+    return {str(b): [len(part), _hash(part)] for b, part in buckets.items()}
+
+
+def _read_json(path: Path, default=None):
+    try:
+        with path.open("rt", encoding="utf-8") as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        return default
+
+
+def _write_json(path: Path, data):
+    tmp = path.parent / (path.name + ".tmp")
+    with tmp.open("wt", encoding="utf-8") as fp:
+        json.dump(data, fp, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def sync_directory(context: DatetimeContext, directory: Path, device: str,
+                   window: int = MERGE_WINDOW_US) -> bool:
+    """
+    通过共享文件夹（网盘、网络共享等）同步：先合并其他设备发布的数据，再发布自己的。
+    每台设备各自定期调用即可。本地有变化返回True
+    """
+    changed = False
+    own = _read_values(context)
+    own_index = _bucket_index(own)
+    for other in sorted(directory.iterdir()) if directory.exists() else ():
+        if not other.is_dir() or other.name == device:
+            continue
+        their_index = _read_json(other / "index.json")
+        if their_index is None:
+            continue
+        diff = sorted(int(b) for b in own_index.keys() | their_index.keys()
+                      if own_index.get(b) != their_index.get(b))
+        if not diff:
+            continue
+        ranges = [(b << BUCKET_BITS, (b + 1) << BUCKET_BITS) for b in diff]
+        parts = [_read_json(other / f"{b}.json", []) if str(b) in their_index else [] for b in diff]
+        if apply_merge(context, ranges, parts, window):
+            changed = True
+            own = _read_values(context)
+            own_index = _bucket_index(own)
+
+    mine = directory / device
+    mine.mkdir(parents=True, exist_ok=True)
+    published = _read_json(mine / "index.json", {})
+    for b, summary in own_index.items():
+        if published.get(b) != summary:
+            _write_json(mine / f"{b}.json", _slice(own, int(b) << BUCKET_BITS, (int(b) + 1) << BUCKET_BITS))
+    # 先写桶再写索引，别人读到的索引总是指向完整的桶
+    _write_json(mine / "index.json", own_index)
+    for b in published.keys() - own_index.keys():
+        (mine / f"{b}.json").unlink(missing_ok=True)
+    return changed
+
+
+def main(argv=None):
+    import command
+    import mytime
+    import path_def
+    path_def.init_path(__file__)
+
+    parser = argparse.ArgumentParser(description="和另一台设备同步本钟的数据")
+    parser.add_argument("--save", type=Path, help="保存文件，默认和窗口程序用同一个")
+    sub = parser.add_subparsers(dest="action", required=True)
+    p = sub.add_parser("serve", help="等待另一台设备来同步")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=DEFAULT_PORT)
+    p = sub.add_parser("connect", help="和正在serve的设备同步")
+    p.add_argument("host")
+    p.add_argument("--port", type=int, default=DEFAULT_PORT)
+    p = sub.add_parser("dir", help="通过共享文件夹同步")
+    p.add_argument("directory", type=Path)
+    p.add_argument("--device", default=socket.gethostname())
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if args.save:
+        mytime.Default_File_Path = args.save
+    context = command.default_context()
+    if args.action == "serve":
+        try:
+            serve(context, args.host, args.port)
+        except KeyboardInterrupt:
+            pass
+    elif args.action == "connect":
+        with SocketPeer(args.host, args.port) as peer:
+            result = sync(context, peer)
+        print(f"交换了{len(result.ranges)}个区间，发送{peer.bytes_sent}字节，接收{peer.bytes_received}字节，"
+              f"本地{'有' if result.local_changed else '没有'}变化，"
+              f"对方{'有' if result.remote_changed else '没有'}变化")
+    else:
+        changed = sync_directory(context, args.directory, args.device)
+        print("本地有变化" if changed else "本地没有变化")
+
+
+if __name__ == '__main__':
+    main()
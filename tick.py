@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+# @File    : tick.py
+# @Date    : 2026-10-19
+# @Author  : 王超逸
+# @Brief   : 所有钟共用的一个定时器，只在显示的内容会变的时候醒
+from __future__ import annotations
+
+import math
+from typing import Callable
+
+import command
+from clock_state import ClockState
+from mytime import DatetimeContext, US_PER_SEC
+
+# 最多睡这么久就重新算一次，钟被拨动了也能跟上
+MAX_SLEEP_US = 60 * US_PER_SEC
+# 相差这么多以内的时刻合成一次唤醒，往后对齐，显示只会晚不会早
+COALESCE_US = 50000
+
+
+class Subscription:
+    """
+    一个订阅：每到下一个unit_us（从这一天开始时算起，所以是主观时间的整秒）或者这一天结束，
+    callback(ClockState)被调用一次
+    """
+    __slots__ = ("callback", "unit_us", "active", "next_us", "group")
+
+    def __init__(self, callback: Callable[[ClockState], None], unit_us: int, group: _Group):
+        self.callback = callback
+        self.unit_us = unit_us
+        self.active = True
+        self.next_us = None
+        self.group = group
+
+    def next_change(self, state: ClockState) -> int:
+        start = state.day_start_us
+        unit = self.unit_us
+        return min(start + ((state.timestamp_us - start) // unit + 1) * unit, state.day_end_us,
+                   state.timestamp_us + MAX_SLEEP_US)
+
+
+class _Group:
+    """同一个历法上的订阅，每次只算一个ClockState"""
+    __slots__ = ("context", "source", "subscriptions")
+
+    def __init__(self, context: DatetimeContext, source: Callable[[], ClockState]):
+        self.context = context
+        self.source = source
+        self.subscriptions: list[Subscription] = []
+
+    def push(self, force=False) -> list[Subscription]:
+        """把新的状态交给到期的订阅，force则交给所有活动的订阅"""
+        now_us = self.context.clock.now_us()
+        due = [sub for sub in self.subscriptions
+               if sub.active and (force or sub.next_us is None or sub.next_us <= now_us)]
+        if not due:
+            return due
+        try:
+            state = self.source()
+        except BaseException:
+            # 一秒后再试，不要一直醒
+            for sub in due:
+                sub.next_us = now_us + US_PER_SEC
+            raise
+        for sub in due:
+            sub.next_us = sub.next_change(state)
+        for sub in due:
+            sub.callback(state)
+        return due
+
+    def delay_us(self) -> int | None:
+        """离最早的一个订阅到期还有多久"""
+        pending = [sub.next_us for sub in self.subscriptions if sub.active]
+        if not pending:
+            return None
+        return min(pending) - self.context.clock.now_us()
+
+
+class TickDispatcher:
+    """
+    多个钟（不同的DatetimeContext，或者同一个历法上的多个控件）共用一个定时器。
+
+    每个订阅自己算出下一次显示会变的时刻，同一个历法上的订阅共用一个ClockState；
+    定时器只设到最早的那个时刻，相差不到COALESCE_US的合成一次。
+    所以唤醒次数只和显示变化的频率有关，和钟的个数无关。
+
+    schedule(delay)由使用者提供：delay秒之后调用wake()，delay为None表示不用再叫醒
+    """
+
+    def __init__(self, schedule: Callable[[float | None], None], coalesce_us: int = COALESCE_US):
+        self.schedule = schedule
+        self.coalesce_us = coalesce_us
+        self._groups: dict[DatetimeContext, _Group] = {}
+        self.wakeups = 0
+
+    def subscribe(self, callback: Callable[[ClockState], None], context=..., unit_us: int = US_PER_SEC,
+                  source: Callable[[], ClockState] = None) -> Subscription:
+        """
+        订阅context上的时间，马上收到一次当前的状态。source默认从守护进程读，没有守护进程时直接算；
+        同一个context上只用第一次订阅给的source
+        """
+        if context is ...:
+            context = command.default_context()
+        group = self._groups.get(context)
+        if group is None:
+            if source is None:
+                # 用到时才引入，钟本身不依赖进程间通信
+                from daemon import DaemonClient
+                source = DaemonClient(context).now
+            group = self._groups[context] = _Group(context, source)
+        sub = Subscription(callback, unit_us, group)
+        group.subscriptions.append(sub)
+        try:
+            group.push()
+        finally:
+            self._reschedule()
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        group = sub.group
+        if sub in group.subscriptions:
+            group.subscriptions.remove(sub)
+            if not group.subscriptions:
+                self._groups.pop(group.context, None)
+        self._reschedule()
+
+    def set_active(self, sub: Subscription, active: bool):
+        """暂停（比如窗口看不见了）或者恢复，恢复时马上收到一次当前的状态"""
+        if sub.active == active:
+            return
+        sub.active = active
+        sub.next_us = None
+        try:
+            if active:
+                sub.group.push()
+        finally:
+            self._reschedule()
+
+    def refresh(self):
+        """不管有没有到期，马上给所有活动的订阅推一次，修改了day_time_map之后用"""
+        try:
+            for group in list(self._groups.values()):
+                group.push(force=True)
+        finally:
+            self._reschedule()
+
+    def wake(self):
+        """定时器到了时调用"""
+        self.wakeups += 1
+        try:
+            for group in list(self._groups.values()):
+                group.push()
+        finally:
+            self._reschedule()
+
+    def next_delay_us(self) -> int | None:
+        delays = [d for d in (group.delay_us() for group in self._groups.values()) if d is not None]
+        if not delays:
+            return None
+        earliest = min(delays)
+        return max(0, max(d for d in delays if d <= earliest + self.coalesce_us))
+
+    def _reschedule(self):
+        delay = self.next_delay_us()
+        self.schedule(None if delay is None else delay / US_PER_SEC)
+
+
+def qt_dispatcher(parent=None) -> TickDispatcher:
+    """用一个单次的QTimer驱动的TickDispatcher，只能在GUI线程中用"""
+    from PyQt5.QtCore import Qt, QTimer
+
+    timer = QTimer(parent)
+    timer.setSingleShot(True)
+    timer.setTimerType(Qt.PreciseTimer)
+
+    def schedule(delay):
+        if delay is None:
+            timer.stop()
+        else:
+            # 宁可晚一毫秒，早了的话显示还没变，要再醒一次
+            timer.start(math.ceil(delay * 1000) + 1)
+
+    dispatcher = TickDispatcher(schedule)
+    timer.timeout.connect(dispatcher.wake)
+    dispatcher.timer = timer
+    return dispatcher
+
+
+_shared: TickDispatcher | None = None
+
+
+def shared() -> TickDispatcher:
+    """整个程序共用的TickDispatcher，第一次用的时候创建，要在QApplication创建之后"""
+    global _shared
+    if _shared is None:
+        _shared = qt_dispatcher()
+    return _shared
+
+
+__all__ = ["Subscription", "TickDispatcher", "qt_dispatcher", "shared"]
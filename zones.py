@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+# @File    : zones.py
+# @Date    : 2026-10-19
+# @Author  : 王超逸
+# @Brief   : 时区换算。每个时区的UTC偏移按小时缓存，批量换算成本地时间时不用逐个构造datetime
+from __future__ import annotations
+
+import time
+from array import array
+from datetime import date, datetime, timedelta, timezone, tzinfo
+from typing import Iterable, Sequence
+from zoneinfo import ZoneInfo
+
+_US_PER_SEC = 1000000
+_ONE_US = timedelta(microseconds=1)
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_DAY_US = 86400 * _US_PER_SEC
+# 1970-01-01的date.toordinal()
+_EPOCH_ORDINAL = 719163
+# 偏移缓存的粒度。一个小时之内最多只认一次切换，现实中的时区没有更密的
+_BUCKET_US = 3600 * _US_PER_SEC
+
+WALL_FIELDS = ("year", "month", "day", "hour", "minute", "second", "microsecond", "utcoffset")
+
+
+class Zone:
+    """
+    一个时区。tz为None时是本机的本地时区，按每个时刻各自的偏移算，夏令时前后不会错。
+
+    偏移按小时分桶缓存：整个小时偏移不变就只记一个数，中间有切换就二分找到切换的那一秒，
+    记下(切换时刻, 之前, 之后)，相当于按需建出来的切换表
+    """
+
+    def __init__(self, tz: tzinfo | None = None):
+        self.tz = tz
+        self._offsets: dict[int, int | tuple[int, int, int]] = {}
+        self._fixed = tz.utcoffset(None) // _ONE_US if isinstance(tz, timezone) else None
+        self._tz_cache: dict[int, timezone] = {}
+        self._suffix_cache: dict[int, str] = {}
+
+    def __repr__(self):
+        return f"<Zone {self.tz if self.tz is not None else 'local'}>"
+
+    def clear(self):
+        """本机时区设置变了之后调用"""
+        self._offsets.clear()
+
+    def _raw_offset_us(self, sec: int) -> int:
+        if self.tz is None:
+            return time.localtime(sec).tm_gmtoff * _US_PER_SEC
+        return datetime.fromtimestamp(sec, self.tz).utcoffset() // _ONE_US
+
+    def _bucket(self, bucket: int):
+        start = bucket * _BUCKET_US // _US_PER_SEC
+        end = start + _BUCKET_US // _US_PER_SEC
+        before = self._raw_offset_us(start)
+        after = self._raw_offset_us(end)
+        if before == after:
+            entry = before
+        else:
+            # 切换总是在整秒上，找第一个是新偏移的秒
+            while end - start > 1:
+                mid = (start + end) // 2
+                if self._raw_offset_us(mid) == before:
+                    start = mid
+                else:
+                    end = mid
+            entry = (end * _US_PER_SEC, before, after)
+        self._offsets[bucket] = entry
+        return entry
+
+    def offset_us(self, t_us: int) -> int:
+        """t_us这一时刻的UTC偏移，微秒"""
+        if self._fixed is not None:
+            return self._fixed
+        bucket = t_us // _BUCKET_US
+        entry = self._offsets.get(bucket)
+        if entry is None:
+            entry = self._bucket(bucket)
+        if entry.__class__ is int:
+            return entry
+        transition, before, after = entry
+        return after if t_us >= transition else before
+
+    def tzinfo_at(self, t_us: int) -> tzinfo:
+        """t_us这一时刻用的tzinfo，本地时区给出固定偏移的timezone"""
+        if self.tz is not None:
+            return self.tz
+        offset = self.offset_us(t_us)
+        tz = self._tz_cache.get(offset)
+        if tz is None:
+            tz = self._tz_cache[offset] = timezone(timedelta(microseconds=offset))
+        return tz
+
+    def to_datetime(self, t_us: int) -> datetime:
+        return (_EPOCH + timedelta(microseconds=t_us)).astimezone(self.tzinfo_at(t_us))
+
+    def _suffix(self, offset: int) -> str:
+        """和datetime.isoformat()一样的偏移写法"""
+        suffix = self._suffix_cache.get(offset)
+        if suffix is None:
+            sign = "-" if offset < 0 else "+"
+            rest, us = divmod(abs(offset), _US_PER_SEC)
+            rest, ss = divmod(rest, 60)
+            hh, mm = divmod(rest, 60)
+            suffix = f"{sign}{hh:02d}:{mm:02d}"
+            if ss or us:
+                suffix += f":{ss:02d}"
+                if us:
+                    suffix += f".{us:06d}"
+            suffix = self._suffix_cache[offset] = suffix
+        return suffix
+
+    def isoformat(self, t_us: int, last_day: list = None) -> str:
+        """
+        和to_datetime(t_us).isoformat()的结果一样。
+        last_day是[天, "YYYY-MM-DDT"]，只记上一次的日期，按时间顺序批量调用时传同一个。
+        只留一格，导出多长都只占常数内存
+        """
+        offset = self.offset_us(t_us)
+        day, t = divmod(t_us + offset, _DAY_US)
+        if last_day is not None and last_day[0] == day:
+            prefix = last_day[1]
+        else:
+            prefix = date.fromordinal(day + _EPOCH_ORDINAL).isoformat() + "T"
+            if last_day is not None:
+                last_day[:] = day, prefix
+        t, us = divmod(t, _US_PER_SEC)
+        t, ss = divmod(t, 60)
+        hh, mm = divmod(t, 60)
+        if us:
+            return f"{prefix}{hh:02d}:{mm:02d}:{ss:02d}.{us:06d}{self._suffix(offset)}"
+        return f"{prefix}{hh:02d}:{mm:02d}:{ss:02d}{self._suffix(offset)}"
+
+
+_zones: dict = {}
+
+
+def get_zone(zone: Zone | tzinfo | str | None = None) -> Zone:
+    """
+    zone可以是Zone、tzinfo（比如zoneinfo.ZoneInfo）、IANA时区名，None是本地时区。
+    同一个时区总是得到同一个Zone，偏移缓存是共用的
+    """
+    if isinstance(zone, Zone):
+        return zone
+    result = _zones.get(zone)
+    if result is None:
+        result = _zones[zone] = Zone(ZoneInfo(zone) if isinstance(zone, str) else zone)
+    return result
+
+
+def wall_fields(timestamps_us: Iterable[int],
+                zone: Zone | tzinfo | str | None | Sequence = None) -> dict[str, array]:
+    """
+    把一组时间戳换算成本地时间的各个字段，每个字段一个array。utcoffset是微秒。
+    zone可以是一个时区，也可以是和时间戳一一对应的一组时区
+    """
+    fields = {name: array("q") for name in WALL_FIELDS}
+    year_a, month_a, day_a, hour_a, minute_a, second_a, us_a, offset_a = \
+        (fields[name].append for name in WALL_FIELDS)
+    if isinstance(zone, (list, tuple)):
+        zone_list = zone
+    else:
+        zone_list = None
+        offset_us = get_zone(zone).offset_us
+    dates = {}
+    for i, t in enumerate(timestamps_us):
+        if zone_list is not None:
+            offset = get_zone(zone_list[i]).offset_us(t)
+        else:
+            offset = offset_us(t)
+        days, t = divmod(t + offset, _DAY_US)
+        ymd = dates.get(days)
+        if ymd is None:
+            d = date.fromordinal(days + _EPOCH_ORDINAL)
+            ymd = dates[days] = d.year, d.month, d.day
+        t, us = divmod(t, _US_PER_SEC)
+        t, ss = divmod(t, 60)
+        hh, mm = divmod(t, 60)
+        year_a(ymd[0])
+        month_a(ymd[1])
+        day_a(ymd[2])
+        hour_a(hh)
+        minute_a(mm)
+        second_a(ss)
+        us_a(us)
+        offset_a(offset)
+    return fields
+
+
+def isoformats(timestamps_us: Iterable[int], zone: Zone | tzinfo | str | None | Sequence = None) -> list[str]:
+    """一组时间戳的ISO 8601字符串，zone的含义和wall_fields一样"""
+    last_day = [None, None]
+    if isinstance(zone, (list, tuple)):
+        return [get_zone(z).isoformat(t, last_day) for t, z in zip(timestamps_us, zone)]
+    isoformat = get_zone(zone).isoformat
+    return [isoformat(t, last_day) for t in timestamps_us]
+
+
+__all__ = ["Zone", "get_zone", "wall_fields", "isoformats", "WALL_FIELDS"]